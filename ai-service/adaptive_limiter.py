@@ -0,0 +1,127 @@
+"""AIMD concurrency limiter with a rate-limit circuit breaker for Claude calls.
+
+The limit grows additively while Anthropic reports healthy capacity and
+responds at a healthy latency, and is cut multiplicatively when the ``anthropic-ratelimit-requests-remaining``
+header runs low or a 429 comes back. After a 429 the breaker opens for the
+server's ``retry-after`` and calls fail fast instead of piling onto a
+provider that is already refusing them.
+"""
+
+import asyncio
+import contextlib
+import math
+import time
+from typing import AsyncIterator, Mapping, Optional
+
+_REMAINING_HEADER = "anthropic-ratelimit-requests-remaining"
+_LIMIT_HEADER = "anthropic-ratelimit-requests-limit"
+_DEFAULT_RETRY_AFTER = 5.0
+# How far the latency baseline moves toward each slower call.
+_BASELINE_DRIFT = 0.05
+
+
+class LimiterOpenError(RuntimeError):
+    """Raised while the breaker is open after a 429."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Claude rate limited; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class AdaptiveLimiter:
+    """Concurrency cap that adapts between ``min_limit`` and ``max_limit``.
+
+    ``increase`` is added per window of ``limit`` successful calls (so
+    increase / limit per call); ``decrease`` multiplies the limit on
+    pressure. ``low_remaining_ratio`` is the fraction of the provider's
+    request budget below which a success still counts as pressure.
+    A success slower than ``latency_tolerance`` times the baseline latency
+    holds the limit instead of growing it.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        *,
+        min_limit: int = 1,
+        increase: float = 0.5,
+        decrease: float = 0.5,
+        low_remaining_ratio: float = 0.1,
+        latency_tolerance: float = 2.0,
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self._increase = increase
+        self._decrease = decrease
+        self._low_remaining_ratio = low_remaining_ratio
+        self._latency_tolerance = latency_tolerance
+        self._baseline_latency: Optional[float] = None
+        self._limit = float(max_limit)
+        self._in_flight = 0
+        self._open_until = 0.0
+        self._cond = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, math.floor(self._limit))
+
+    def check_open(self) -> None:
+        """Raise LimiterOpenError while the breaker is open."""
+        remaining = self._open_until - time.monotonic()
+        if remaining > 0:
+            raise LimiterOpenError(remaining)
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one concurrency slot for the duration of a Claude call."""
+        self.check_open()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        try:
+            self.check_open()
+            yield
+        finally:
+            async with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def record_success(self, headers: Mapping[str, str], latency: Optional[float] = None) -> None:
+        """Adjust the limit after a call that got response ``headers`` in ``latency`` seconds."""
+        remaining = _header_float(headers, _REMAINING_HEADER)
+        total = _header_float(headers, _LIMIT_HEADER)
+        if remaining is not None and total and remaining < total * self._low_remaining_ratio:
+            self._shrink()
+        elif latency is None or self._healthy_latency(latency):
+            self._limit = min(float(self.max_limit), self._limit + self._increase / self._limit)
+
+    def _healthy_latency(self, latency: float) -> bool:
+        baseline = self._baseline_latency
+        if baseline is None or latency < baseline:
+            self._baseline_latency = latency
+            return True
+        # Drift up slowly so one unusually fast call doesn't pin the baseline.
+        self._baseline_latency = baseline + (latency - baseline) * _BASELINE_DRIFT
+        return latency <= baseline * self._latency_tolerance
+
+    def record_rate_limited(self, headers: Mapping[str, str]) -> float:
+        """Shrink the limit and open the breaker; returns the pause in seconds."""
+        retry_after = _header_float(headers, "retry-after")
+        if retry_after is None or retry_after <= 0:
+            retry_after = _DEFAULT_RETRY_AFTER
+        self._open_until = max(self._open_until, time.monotonic() + retry_after)
+        self._shrink()
+        return retry_after
+
+    def _shrink(self) -> None:
+        self._limit = max(float(self.min_limit), self._limit * self._decrease)
@@ -5,100 +5,201 @@ Mirrors the authentication flow in the monolith:
   - backend/src/core/admin.py (allowlist pattern)
 
 Returns HTTP 404 for unauthorized users (security through obscurity).
+
+Verified tokens can be cached for AI_JWT_CACHE_TTL seconds so replayed
+cookies skip signature verification; only a digest of the token is kept.
 """
 
+import base64
+import hashlib
+import hmac
 import logging
-from functools import lru_cache
-from typing import Optional, Set
+import threading
+import time
+from typing import FrozenSet, Optional, Tuple
 
+import jwt
+import orjson
+from cachetools import TLRUCache
 from fastapi import HTTPException, Request
-from jose import JWTError, jwt
 
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+_SECRET_KEY = settings.SECRET_KEY
+_ALGORITHMS = [settings.ALGORITHM]
+
+# Keyed once; each HS256 verification copies this instead of re-keying HMAC.
+_HMAC_PROTO = (
+    hmac.new(_SECRET_KEY.encode(), digestmod=hashlib.sha256)
+    if settings.ALGORITHM == "HS256"
+    else None
+)
+
+_TOKEN_CACHE_MAXSIZE = 10_000
+
+# digest -> (username, expires_at); entries expire at their own wall-clock deadline.
+_token_cache: "TLRUCache[bytes, Tuple[str, float]]" = TLRUCache(
+    maxsize=_TOKEN_CACHE_MAXSIZE,
+    ttu=lambda _key, value, _now: value[1],
+    timer=time.time,
+)
+_token_cache_lock = threading.Lock()
+
+
+def _token_cache_key(token: str) -> bytes:
+    """Key the cache by a truncated SHA-256 digest, never the raw token."""
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
 
-@lru_cache(maxsize=1)
-def get_ai_allowlist() -> Set[str]:
-    """Parse AI allowlist env var into set of lowercase usernames.
 
-    Resolution order:
-    1) AI_ALLOWLIST
-    2) ADMIN_ALLOWLIST (legacy fallback)
-    3) hard-coded default
+# The fast path only handles tokens shaped like the backend's: a plain
+# {"alg": "HS256"[, "typ": "JWT"]} header and integer registered claims.
+# Anything else (aud, iss, jti, kid, crit, float or string times, ...) goes
+# through jwt.decode so every claim rule stays PyJWT's own.
+_FAST_HEADERS = ({"alg": "HS256"}, {"alg": "HS256", "typ": "JWT"})
+_FAST_TIME_CLAIMS = ("iat", "nbf", "exp")
+_FAST_CLAIMS = frozenset(("sub",) + _FAST_TIME_CLAIMS)
+
+
+def _jwt_decode(token: str) -> dict:
+    return jwt.decode(
+        token,
+        _SECRET_KEY,
+        algorithms=_ALGORITHMS,
+        options={"require": ["sub", "exp"]},
+    )
+
+
+def _is_fast_payload(payload: object) -> bool:
+    if not isinstance(payload, dict) or not _FAST_CLAIMS.issuperset(payload):
+        return False
+    if not isinstance(payload.get("sub"), str):
+        return False
+    return all(
+        type(payload[claim]) is int for claim in _FAST_TIME_CLAIMS if claim in payload
+    )
+
+
+def _decode_token(token: str) -> dict:
+    """Verify a JWT and return its claims, requiring sub and exp.
+
+    Backend-shaped HS256 tokens are checked against the pre-keyed HMAC with
+    the same iat/nbf/exp rules jwt.decode applies at zero leeway; every other
+    token goes through jwt.decode. Raises jwt.PyJWTError on any failure.
     """
-    raw = settings.AI_ALLOWLIST or settings.ADMIN_ALLOWLIST or ""
-    if not raw.strip():
-        raw = "admina;guest2;guest3"
-
-    allowlist = {
-        username.strip().lower()
-        for username in raw.split(";")
-        if username.strip()
-    }
-    logger.info("AI allowlist loaded: %s users", len(allowlist))
-    return allowlist
-
-
-@lru_cache(maxsize=1)
-def get_admin_allowlist() -> Set[str]:
-    """Parse ADMIN_ALLOWLIST env var into set of lowercase usernames."""
-    raw = settings.ADMIN_ALLOWLIST or ""
-    if not raw.strip():
-        raw = "admina"
-
-    allowlist = {
-        username.strip().lower()
-        for username in raw.split(";")
-        if username.strip()
-    }
-    logger.info("Admin allowlist loaded: %s users", len(allowlist))
-    return allowlist
+    if _HMAC_PROTO is None:
+        return _jwt_decode(token)
+
+    signing_input, _, signature_b64 = token.rpartition(".")
+    header_b64, _, payload_b64 = signing_input.partition(".")
+    if not header_b64 or not payload_b64 or "." in payload_b64:
+        return _jwt_decode(token)
+    try:
+        header = orjson.loads(_b64url_decode(header_b64))
+        if header not in _FAST_HEADERS:
+            return _jwt_decode(token)
+        signature = _b64url_decode(signature_b64)
+        mac = _HMAC_PROTO.copy()
+        mac.update(signing_input.encode())
+        if not hmac.compare_digest(mac.digest(), signature):
+            raise jwt.InvalidSignatureError("Signature verification failed")
+        payload = orjson.loads(_b64url_decode(payload_b64))
+    except ValueError:
+        return _jwt_decode(token)
+    if not _is_fast_payload(payload):
+        return _jwt_decode(token)
+
+    # Same order and comparisons as PyJWT's _validate_claims with leeway=0.
+    if "exp" not in payload:
+        raise jwt.MissingRequiredClaimError("exp")
+    now = time.time()
+    if "iat" in payload and payload["iat"] > now:
+        raise jwt.ImmatureSignatureError("The token is not yet valid (iat)")
+    if "nbf" in payload and payload["nbf"] > now:
+        raise jwt.ImmatureSignatureError("The token is not yet valid (nbf)")
+    if payload["exp"] <= now:
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    return payload
+
+
+# Parsed once at import; callers read these module constants directly.
+_AI_ALLOWLIST: FrozenSet[str] = settings.ai_allowlist_set
+_ADMIN_ALLOWLIST: FrozenSet[str] = settings.admin_allowlist_set
+_AI_OR_ADMIN_ALLOWLIST: FrozenSet[str] = _AI_ALLOWLIST | _ADMIN_ALLOWLIST
+logger.info(
+    "Allowlists loaded: %s AI users, %s admin users",
+    len(_AI_ALLOWLIST),
+    len(_ADMIN_ALLOWLIST),
+)
+
+
+def _normalize_username(username: str) -> str:
+    # sub claims are usually lowercase already; skip the copy lower() would make.
+    return username if username.islower() else username.lower()
 
 
 def is_user_admin(username: str) -> bool:
-    return username.lower() in get_admin_allowlist()
+    return _normalize_username(username) in _ADMIN_ALLOWLIST
 
 
 def is_user_allowed_for_ai(username: str) -> bool:
     """Check if username is admin or in AI allowlist (case-insensitive)."""
-    username_norm = username.lower()
-    return username_norm in get_ai_allowlist() or username_norm in get_admin_allowlist()
+    return _normalize_username(username) in _AI_OR_ADMIN_ALLOWLIST
+
 
+async def require_ai_access(request: Request) -> str:
+    """FastAPI dependency that enforces AI allowlist.
 
-def get_username_from_token(request: Request) -> str:
-    """Extract and verify the JWT token from the access_token cookie.
+    Extracts and verifies the JWT from the access_token cookie and checks the
+    sub claim against the admin-or-AI allowlist, all in one frame since every
+    AI request resolves this dependency.
 
-    Returns the username (sub claim) if valid.
-    Raises HTTPException(404) if token is missing or invalid.
+    Returns the username if authorized for AI access.
+    Raises HTTPException(404) for unauthorized or unauthenticated users.
     """
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=404, detail="Not Found")
 
-    # Strip 'Bearer ' prefix if present
-    if token.startswith("Bearer "):
-        token = token[7:]
+    token = token.removeprefix("Bearer ")
+
+    cache_ttl = settings.AI_JWT_CACHE_TTL
+    cache_key = _token_cache_key(token) if cache_ttl > 0 else None
+    username: Optional[str] = None
+    if cache_key is not None:
+        with _token_cache_lock:
+            cached = _token_cache.get(cache_key)
+        if cached is not None:
+            username = cached[0]
+
+    if username is None:
+        # Verification never awaits, so on the event loop the miss, decode and
+        # cache fill run without interleaving: concurrent requests carrying the
+        # same token can't overlap here and need no in-flight coalescing.
+        try:
+            payload = _decode_token(token)
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=404, detail="Not Found")
 
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: Optional[str] = payload.get("sub")
+        username = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=404, detail="Not Found")
-        return username
-    except JWTError:
-        raise HTTPException(status_code=404, detail="Not Found")
-
 
-async def require_ai_access(request: Request) -> str:
-    """FastAPI dependency that enforces AI allowlist.
+        if cache_key is not None:
+            # Never cache past the token's own expiry.
+            expires_at = time.time() + cache_ttl
+            exp = payload.get("exp")
+            if isinstance(exp, (int, float)):
+                expires_at = min(expires_at, float(exp))
+            with _token_cache_lock:
+                _token_cache[cache_key] = (username, expires_at)
 
-    Returns the username if authorized for AI access.
-    Raises HTTPException(404) for unauthorized or unauthenticated users.
-    """
-    username = get_username_from_token(request)
-    if not is_user_allowed_for_ai(username):
+    if _normalize_username(username) not in _AI_OR_ADMIN_ALLOWLIST:
         raise HTTPException(status_code=404, detail="Not Found")
     return username
 
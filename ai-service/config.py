@@ -1,12 +1,30 @@
 """Configuration for ai-service, loaded from environment variables."""
 
+import re
+from functools import cached_property
+from typing import FrozenSet, Tuple
+
 from pydantic_settings import BaseSettings
 
 
+# One non-blank entry of a semicolon-separated list.
+_ALLOWLIST_TOKEN_RE = re.compile(r"[^;\s][^;]*")
+
+
+def _parse_allowlist(raw: str) -> FrozenSet[str]:
+    """Split a semicolon-separated username list into lowercase names."""
+    return frozenset(
+        match.group(0).strip().lower()
+        for match in _ALLOWLIST_TOKEN_RE.finditer(raw)
+    )
+
+
 class Settings(BaseSettings):
     # JWT verification (shared with monolith)
     SECRET_KEY: str = "T)mat)P)OtatTo#)92"
     ALGORITHM: str = "HS256"
+    # Seconds a verified access_token stays cached (0 disables the cache).
+    AI_JWT_CACHE_TTL: int = 0
 
     # AI allowlist (semicolon-separated, case-insensitive)
     # This is intentionally separate from monolith ADMIN_ALLOWLIST.
@@ -25,6 +43,16 @@ class Settings(BaseSettings):
     AI_RATE_LIMIT_PER_HOUR: int = 10
     LOCAL_QA_RATE_LIMIT_PER_HOUR: int = 20
 
+    # Clarification panel memoization (entries / seconds; 0 disables)
+    AI_PANEL_CACHE_SIZE: int = 256
+    AI_PANEL_CACHE_TTL: int = 300
+    # Identical agent prompts share one Claude call (entries / seconds; 0 disables)
+    AI_AGENT_CACHE_SIZE: int = 512
+    AI_AGENT_CACHE_TTL: int = 60
+
+    # Seconds of stream silence before an SSE keep-alive comment (0 disables)
+    AI_SSE_KEEPALIVE_SECONDS: float = 15.0
+
     # Development diagnostics
     AI_DEBUG_LOG: bool = False
 
@@ -32,6 +60,17 @@ class Settings(BaseSettings):
     ANTHROPIC_API_KEY: str = ""
     CLAUDE_MODEL: str = "claude-3-haiku-20240307"
     ANTHROPIC_API_BASE: str = "https://api.anthropic.com"
+    # Ceiling for in-flight Claude calls per worker; adapts down under
+    # Anthropic rate-limit pressure (0 disables)
+    ANTHROPIC_MAX_CONCURRENCY: int = 10
+
+    # Gmail agent response cache (entries; 0 disables)
+    GMAIL_AGENT_CACHE_SIZE: int = 512
+    # Gmail agent client-side Anthropic budget, shared by all workers via Redis.
+    # 0 derives it from AI_RATE_LIMIT_PER_HOUR (see token_bucket_budget);
+    # setting only one of the pair logs a warning.
+    GMAIL_AGENT_REQUESTS_PER_MINUTE: int = 0
+    GMAIL_AGENT_TOKENS_PER_MINUTE: int = 0
 
     # Local Q&A configuration (CrewAI + local vLLM)
     FEATURE_LOCAL_QA: bool = True
@@ -39,5 +78,29 @@ class Settings(BaseSettings):
     LOCAL_QA_MODEL_NAME: str = "Qwen/Qwen3.5-4B"
     LOCAL_QA_API_KEY: str = "NA"
 
+    @cached_property
+    def allowed_origins_list(self) -> Tuple[str, ...]:
+        """ALLOWED_ORIGINS split on commas, trimmed, blanks dropped."""
+        return tuple(
+            origin.strip()
+            for origin in self.ALLOWED_ORIGINS.split(",")
+            if origin.strip()
+        )
+
+    @cached_property
+    def ai_allowlist_set(self) -> FrozenSet[str]:
+        """AI_ALLOWLIST, falling back to ADMIN_ALLOWLIST, then the default."""
+        raw = self.AI_ALLOWLIST or self.ADMIN_ALLOWLIST or ""
+        if not raw.strip():
+            raw = "admina;guest2;guest3"
+        return _parse_allowlist(raw)
+
+    @cached_property
+    def admin_allowlist_set(self) -> FrozenSet[str]:
+        raw = self.ADMIN_ALLOWLIST or ""
+        if not raw.strip():
+            raw = "admina"
+        return _parse_allowlist(raw)
+
 
 settings = Settings()
@@ -1,16 +1,273 @@
+"""Gmail agent: follow-up questions, summaries and ranking via Claude.
+
+All model calls go through AsyncAnthropic and are awaited directly, so the
+/ai/gmail/* handlers stay plain async endpoints: the work is network-bound,
+never blocks the event loop, and needs no threadpool offload.
+"""
+
+import asyncio
+import hashlib
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import re
+from dataclasses import dataclass
+from itertools import islice
+from typing import List, Dict, Any, Callable, Iterable, Optional
 import os
 
+import orjson
 from anthropic import AsyncAnthropic
+from cachetools import LRUCache
+
+import rate_limiter
 
 logger = logging.getLogger(__name__)
 
+_JSON_SYSTEM_PROMPT = "You are a helpful AI assistant. Output only valid JSON. No markdown fences."
+_JUDGE_SYSTEM_PROMPT = "You are a judge AI. Output only valid JSON. No markdown fences."
+
+_FOLLOWUP_PROMPT = """You are an intelligent assistant helping a user filter their Gmail inbox.
+The user's primary interest is: "{interest}".
+
+previous answers (if any): {previous_answers}
+
+Your goal is to understand what specific type of emails they want to prioritize within this interest.
+Generate exactly 2 short, distinct follow-up questions to ask the user.
+Return ONLY a JSON array of strings, e.g., ["Question 1?", "Question 2?"].
+Do not include any other text.
+"""
+
+_SUMMARY_PROMPT_BASE = """You are an expert email analyst.
+User Interest: {interest}
+User Context/Answers: {answers}
+
+Here are the user's recent emails (truncated content):
+{email_text}
+
+"""
+
+_ACTION_SUMMARY_PROMPT = _SUMMARY_PROMPT_BASE + """Task:
+Write a summary that focuses strictly on ACTIONABLE items, deadlines, and urgent tasks.
+
+Return ONLY a JSON object with key "summary".
+Example: {{"summary": "Action items..."}}
+"""
+
+_INSIGHT_SUMMARY_PROMPT = _SUMMARY_PROMPT_BASE + """Task:
+Write a summary that focuses on INSIGHTS, trends, and key information (newsletters, updates).
+
+Return ONLY a JSON object with key "summary".
+Example: {{"summary": "Insights..."}}
+"""
+
+_JUDGE_PROMPT = """You are a 'Judge' AI.
+User Interest: {interest}
+User Context: {answers}
+
+Summary A (Action): {summary_a}
+Summary B (Insight): {summary_b}
+
+Task:
+1. Decide which summary style is more relevant to the user's interest/context, or merge them if both are vital.
+2. Select the top 5 most relevant emails from the list provided below.
+3. Explain your reasoning.
+
+Email List (for selection context):
+{email_list}
+
+Return a JSON object with this exact structure:
+{{
+    "final_summary": "The combined or selected best summary text...",
+    "top_email_ids": ["id1", "id2", ...],
+    "reasoning": "Why you chose this focus..."
+}}
+"""
+
+_PIPELINE_PROMPT = """You are an expert email analyst and judge.
+User Interest: {interest}
+User Context/Answers: {answers}
+
+Here are the user's recent emails (truncated content):
+{email_text}
+
+Task:
+1. Write "summary_a": focus strictly on ACTIONABLE items, deadlines, and urgent tasks.
+2. Write "summary_b": focus on INSIGHTS, trends, and key information (newsletters, updates).
+3. Decide which summary style is more relevant to the user's interest/context, or merge them if both are vital, and write the result as "final_summary".
+4. Select the top 5 most relevant emails by their ID.
+5. Explain your reasoning.
+
+Return ONLY a JSON object with this exact structure:
+{{
+    "summary_a": "Action items...",
+    "summary_b": "Insights...",
+    "final_summary": "The combined or selected best summary text...",
+    "top_email_ids": ["id1", "id2", ...],
+    "reasoning": "Why you chose this focus..."
+}}
+"""
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+_MAX_EMAILS = 20
+# The largest max_tokens any agent call asks for.
+_PIPELINE_MAX_TOKENS = 2500
+
+_EMAIL_LINE = "- From: {sender}\n  Subject: {subject}\n  Body: {body}"
+_PIPELINE_EMAIL_LINE = "- ID: {message_id}\n  From: {sender}\n  Subject: {subject}\n  Received: {received_at}\n  Body: {body}"
+
+
+@dataclass(slots=True, frozen=True)
+class EmailCtx:
+    """The fields the agent reads from one email, extracted once per request."""
+
+    message_id: Any
+    sender: Any
+    subject: Any
+    received_at: Any
+    body: str
+    # JSON object of the judge's selection fields, serialized once here.
+    meta_json: bytes
+
+    @classmethod
+    def from_dict(cls, email: Dict[str, Any]) -> "EmailCtx":
+        message_id = email.get("message_id")
+        sender = email.get("from")
+        subject = email.get("subject")
+        received_at = email.get("received_at")
+        return cls(
+            message_id=message_id,
+            sender=sender,
+            subject=subject,
+            received_at=received_at,
+            body=(email.get("body") or email.get("snippet") or "")[:500],
+            meta_json=orjson.dumps(
+                {"message_id": message_id, "subject": subject, "from": sender, "received_at": received_at}
+            ),
+        )
+
+
+def build_email_contexts(emails: Iterable[Dict[str, Any]]) -> List[EmailCtx]:
+    """Extract the first _MAX_EMAILS emails into EmailCtx records (limits tokens)."""
+    return [EmailCtx.from_dict(email) for email in islice(emails, _MAX_EMAILS)]
+
+
+def _is_pipeline_result(result: Any) -> bool:
+    """Whether a fused pipeline reply has the fields run_full_pipeline returns."""
+    return (
+        isinstance(result, dict)
+        and isinstance(result.get("final_summary"), str)
+        and isinstance(result.get("top_email_ids"), list)
+    )
+
+
+def token_bucket_budget(
+    requests_per_minute: int, tokens_per_minute: int, hourly_quota: int
+) -> tuple[int, int]:
+    """Resolve the configured (requests, tokens) per minute budget.
+
+    Unset (0) values are derived: one per-user hourly quota of requests per
+    minute, each budgeted at the largest max_tokens an agent call uses.
+    """
+    if (requests_per_minute > 0) != (tokens_per_minute > 0):
+        logger.warning(
+            "Only one of GMAIL_AGENT_REQUESTS_PER_MINUTE / GMAIL_AGENT_TOKENS_PER_MINUTE "
+            "is set; deriving the other"
+        )
+    if requests_per_minute <= 0:
+        requests_per_minute = hourly_quota
+    if tokens_per_minute <= 0:
+        tokens_per_minute = requests_per_minute * _PIPELINE_MAX_TOKENS
+    return requests_per_minute, tokens_per_minute
+
+
+class _TokenBucket:
+    """Client-side requests-per-minute and tokens-per-minute budget.
+
+    Anthropic's limits are per API key, so the bucket state lives in Redis
+    and every worker draws on the same budget. acquire() sleeps just long
+    enough for the scarcer of the two to cover the next call, so bursts
+    queue locally instead of tripping Anthropic's 429 backoff.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        # A single call larger than the whole budget would otherwise wait forever.
+        needed = min(estimated_tokens, self.tokens_per_minute)
+        while True:
+            wait = await rate_limiter.take_tokens(
+                "gmail_agent", self.requests_per_minute, self.tokens_per_minute, needed
+            )
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
 class GmailAgent:
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        cache_size: int = 512,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+    ):
         self.client = AsyncAnthropic(api_key=api_key)
         self.model = os.getenv("CLAUDE_MODEL", "claude-3-haiku-20240307")
+        # Parsed responses keyed by SHA-256 of the full request; 0 disables caching.
+        self._response_cache: Optional[LRUCache] = LRUCache(maxsize=cache_size) if cache_size > 0 else None
+        # Throttling is off unless both budgets are positive.
+        self._bucket: Optional[_TokenBucket] = (
+            _TokenBucket(requests_per_minute, tokens_per_minute)
+            if requests_per_minute > 0 and tokens_per_minute > 0
+            else None
+        )
+
+    def _cache_key(self, system: str, prompt: str, temperature: float, max_tokens: int) -> bytes:
+        material = f"{self.model}|{temperature}|{max_tokens}|{system}|{prompt}"
+        return hashlib.sha256(material.encode()).digest()
+
+    async def _create_json(
+        self,
+        system: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        should_cache: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Call Claude and parse its JSON reply, reusing cached results for identical requests.
+
+        ``should_cache`` can reject replies the caller won't use, so the next
+        identical request calls Claude again instead of reusing them.
+        """
+        key = self._cache_key(system, prompt, temperature, max_tokens)
+        if self._response_cache is not None:
+            cached = self._response_cache.get(key)
+            if cached is not None:
+                return cached
+
+        if self._bucket is not None:
+            await self._bucket.acquire(max_tokens)
+
+        # Streamed, though the reply is only parsed once complete: events keep
+        # the connection active, so the HTTP read timeout applies between
+        # events instead of to one body read covering the whole generation.
+        chunks: List[str] = []
+        async with self.client.messages.stream(
+            model=self.model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system,
+            messages=[{"role": "user", "content": prompt}]
+        ) as stream:
+            async for text in stream.text_stream:
+                chunks.append(text)
+        parsed = self._clean_and_parse_json("".join(chunks))
+        if self._response_cache is not None and (should_cache is None or should_cache(parsed)):
+            self._response_cache[key] = parsed
+        return parsed
 
     def _clean_and_parse_json(self, text: str) -> Any:
         """
@@ -18,15 +275,18 @@ class GmailAgent:
         Handles Markdown fences and potential extra text.
         """
         # Remove Markdown code blocks
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0]
-        
+        fence = _FENCE_RE.search(text)
+        if fence:
+            text = fence.group(1)
+
         text = text.strip()
 
         def _try_parse(candidate: str) -> Any:
-            return json.loads(candidate, strict=False)
+            try:
+                return orjson.loads(candidate)
+            except orjson.JSONDecodeError:
+                # orjson rejects raw control characters inside strings; stdlib is lenient.
+                return json.loads(candidate, strict=False)
 
         try:
             return _try_parse(text)
@@ -50,114 +310,110 @@ class GmailAgent:
         Generate 2 follow-up questions based on the user's interest and previous answers.
         """
         previous_answers = previous_answers or []
-        prompt = f"""You are an intelligent assistant helping a user filter their Gmail inbox.
-        The user's primary interest is: "{interest}".
-        
-        previous answers (if any): {previous_answers}
-
-        Your goal is to understand what specific type of emails they want to prioritize within this interest.
-        Generate exactly 2 short, distinct follow-up questions to ask the user.
-        Return ONLY a JSON array of strings, e.g., ["Question 1?", "Question 2?"].
-        Do not include any other text.
-        """
+        prompt = _FOLLOWUP_PROMPT.format(interest=interest, previous_answers=previous_answers)
 
         try:
-            message = await self.client.messages.create(
-                model=self.model,
-                max_tokens=200,
-                temperature=0.5,
-                system="You are a helpful AI assistant. Output only valid JSON. No markdown fences.",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            content = message.content[0].text
-            return self._clean_and_parse_json(content)
+            return await self._create_json(_JSON_SYSTEM_PROMPT, prompt, temperature=0.5, max_tokens=200)
         except Exception as e:
-            logger.error(f"Failed to generate questions: {e}")
+            logger.error("Failed to generate questions: %s", e)
             return [
                 f"What specific topics within {interest} matter most?",
                 "Are you looking for newsletters, personal updates, or transactional emails?"
             ]
 
-    async def generate_summaries(self, emails: List[Dict[str, Any]], interest: str, answers: List[str]) -> Dict[str, str]:
+    async def _generate_summary(self, template: str, email_text: str, interest: str, answers: List[str]) -> str:
+        prompt = template.format(interest=interest, answers=answers, email_text=email_text)
+        parsed = await self._create_json(_JSON_SYSTEM_PROMPT, prompt, temperature=0.5, max_tokens=800)
+        summary = parsed.get("summary") if isinstance(parsed, dict) else None
+        if not isinstance(summary, str):
+            raise ValueError("summary missing from model output")
+        return summary
+
+    async def generate_summaries(self, emails: List[EmailCtx], interest: str, answers: List[str]) -> Dict[str, str]:
         """
         Generate two distinct summaries (Action-focused vs. Insight-focused).
-        """
-        email_text = "\n".join([
-            f"- From: {e.get('from')}\n  Subject: {e.get('subject')}\n  Body: {e.get('body', e.get('snippet'))[:500]}"
-            for e in emails[:20] # Limit to 20 emails for deep analysis to save tokens
-        ])
 
-        prompt = f"""You are an expert email analyst.
-        User Interest: {interest}
-        User Context/Answers: {answers}
-
-        Here are the user's recent emails (truncated content):
-        {email_text}
+        Both depend only on the same inputs, so they run as two concurrent calls.
+        """
+        email_text = "\n".join(
+            _EMAIL_LINE.format(sender=e.sender, subject=e.subject, body=e.body)
+            for e in emails
+        )
 
-        Task:
-        1. Generate 'Summary A': Focus strictly on ACTIONABLE items, deadlines, and urgent tasks.
-        2. Generate 'Summary B': Focus on INSIGHTS, trends, and key information (newsletters, updates).
+        action, insight = await asyncio.gather(
+            self._generate_summary(_ACTION_SUMMARY_PROMPT, email_text, interest, answers),
+            self._generate_summary(_INSIGHT_SUMMARY_PROMPT, email_text, interest, answers),
+            return_exceptions=True,
+        )
+        if isinstance(action, BaseException):
+            logger.error("Failed to generate action summary: %s", action)
+            action = "Error generating action summary."
+        if isinstance(insight, BaseException):
+            logger.error("Failed to generate insight summary: %s", insight)
+            insight = "Error generating insight summary."
+        return {"summary_a": action, "summary_b": insight}
 
-        Return ONLY a JSON object with keys "summary_a" and "summary_b".
-        Example: {{"summary_a": "Action items...", "summary_b": "Insights..."}}
+    async def judge_and_rank(self, emails: List[EmailCtx], summary_a: str, summary_b: str, interest: str, answers: List[str]) -> Dict[str, Any]:
         """
+        Judge the two summaries and the emails to produce a final report.
+        """
+        email_list = (b"[" + b",".join(e.meta_json for e in emails) + b"]").decode()
+        prompt = _JUDGE_PROMPT.format(
+            interest=interest,
+            answers=answers,
+            summary_a=summary_a,
+            summary_b=summary_b,
+            email_list=email_list,
+        )
 
         try:
-            message = await self.client.messages.create(
-                model=self.model,
-                max_tokens=1500,
-                temperature=0.5,
-                system="You are a helpful AI assistant. Output only valid JSON. No markdown fences.",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return self._clean_and_parse_json(message.content[0].text)
+            return await self._create_json(_JUDGE_SYSTEM_PROMPT, prompt, temperature=0.3, max_tokens=1000)
         except Exception as e:
-            logger.error(f"Failed to generate summaries: {e}")
+            logger.error("Failed to judge summaries: %s", e)
             return {
-                "summary_a": "Error generating action summary.",
-                "summary_b": "Error generating insight summary."
+                "final_summary": summary_a + "\n\n" + summary_b,
+                "top_email_ids": [],
+                "reasoning": "Fallback due to error."
             }
 
-    async def judge_and_rank(self, emails: List[Dict[str, Any]], summary_a: str, summary_b: str, interest: str, answers: List[str]) -> Dict[str, Any]:
-        """
-        Judge the two summaries and the emails to produce a final report.
+    async def run_full_pipeline(self, emails: List[EmailCtx], interest: str, answers: List[str]) -> Dict[str, Any]:
         """
-        prompt = f"""You are a 'Judge' AI.
-        User Interest: {interest}
-        User Context: {answers}
-
-        Summary A (Action): {summary_a}
-        Summary B (Insight): {summary_b}
-
-        Task:
-        1. Decide which summary style is more relevant to the user's interest/context, or merge them if both are vital.
-        2. Select the top 5 most relevant emails from the list provided below.
-        3. Explain your reasoning.
-
-        Email List (for selection context):
-        {json.dumps([{k: v for k, v in e.items() if k in ['message_id', 'subject', 'from', 'received_at']} for e in emails[:20]])}
-
-        Return a JSON object with this exact structure:
-        {{
-            "final_summary": "The combined or selected best summary text...",
-            "top_email_ids": ["id1", "id2", ...],
-            "reasoning": "Why you chose this focus..."
-        }}
+        Summarize, judge and rank in a single Claude call.
+
+        Returns the judge_and_rank shape. Falls back to the two-stage
+        generate_summaries + judge_and_rank flow if the fused reply is unusable.
         """
+        email_text = "\n".join(
+            _PIPELINE_EMAIL_LINE.format(
+                message_id=e.message_id,
+                sender=e.sender,
+                subject=e.subject,
+                received_at=e.received_at,
+                body=e.body,
+            )
+            for e in emails
+        )
+        prompt = _PIPELINE_PROMPT.format(interest=interest, answers=answers, email_text=email_text)
 
         try:
-            message = await self.client.messages.create(
-                model=self.model,
-                max_tokens=1000,
+            result = await self._create_json(
+                _JUDGE_SYSTEM_PROMPT,
+                prompt,
                 temperature=0.3,
-                system="You are a judge AI. Output only valid JSON. No markdown fences.",
-                messages=[{"role": "user", "content": prompt}]
+                max_tokens=_PIPELINE_MAX_TOKENS,
+                should_cache=_is_pipeline_result,
             )
-            return self._clean_and_parse_json(message.content[0].text)
+            if _is_pipeline_result(result):
+                return result
+            logger.warning("Fused Gmail pipeline returned an incomplete result; using staged flow")
         except Exception as e:
-            logger.error(f"Failed to judge summaries: {e}")
-            return {
-                "final_summary": summary_a + "\n\n" + summary_b,
-                "top_email_ids": [],
-                "reasoning": "Fallback due to error."
-            }
+            logger.error("Fused Gmail pipeline failed: %s", e)
+
+        summaries = await self.generate_summaries(emails=emails, interest=interest, answers=answers)
+        return await self.judge_and_rank(
+            emails=emails,
+            summary_a=summaries.get("summary_a", ""),
+            summary_b=summaries.get("summary_b", ""),
+            interest=interest,
+            answers=answers,
+        )
@@ -2,12 +2,12 @@
 
 from __future__ import annotations
 
-import json
 import logging
 import re
 from typing import Any, AsyncIterator, Optional
 
 import httpx
+import orjson
 
 from config import settings
 
@@ -55,6 +55,35 @@ def _normalize_text(value: str) -> str:
     return re.sub(r"\s+", " ", value).strip()
 
 
+async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[bytes]:
+    """Yield the payload of each non-empty ``data:`` line until ``[DONE]``.
+
+    Frames are split straight out of one growing byte buffer instead of
+    going through httpx's per-line text decoding; only JSON payloads reach
+    the caller, still as bytes, for orjson.
+    """
+    buf = bytearray()
+    async for chunk in response.aiter_bytes(65536):
+        buf.extend(chunk)
+        start = 0
+        while (end := buf.find(b"\n", start)) != -1:
+            line_start, start = start, end + 1
+            if not buf.startswith(b"data:", line_start):
+                continue
+            data = bytes(buf[line_start + 5:end]).strip()
+            if not data:
+                continue
+            if data == b"[DONE]":
+                return
+            yield data
+        del buf[:start]
+    # A final line without a trailing newline.
+    if buf.startswith(b"data:"):
+        data = bytes(buf[5:]).strip()
+        if data and data != b"[DONE]":
+            yield data
+
+
 class LocalQAOrchestrator:
     """Routes local Q&A to CrewAI backed by a local vLLM endpoint."""
 
@@ -199,17 +228,10 @@ class LocalQAOrchestrator:
                         f"Local vLLM streaming failed ({response.status_code}): {body[:500]}"
                     )
 
-                async for line in response.aiter_lines():
-                    if not line or not line.startswith("data:"):
-                        continue
-                    data = line[5:].strip()
-                    if not data:
-                        continue
-                    if data == "[DONE]":
-                        break
+                async for data in _iter_sse_data(response):
                     try:
-                        chunk = json.loads(data)
-                    except json.JSONDecodeError:
+                        chunk = orjson.loads(data)
+                    except orjson.JSONDecodeError:
                         continue
 
                     choices = chunk.get("choices")
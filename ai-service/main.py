@@ -15,21 +15,29 @@ Endpoints:
   /ai/gmail/summary   — Gmail agent summarization
 """
 
-import json
+import asyncio
 import logging
+import math
 import re
-from typing import Literal, Optional, List, Dict, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator, Literal, Optional, List, Dict, Any
 
-from fastapi import Depends, FastAPI, HTTPException, Request
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.exception_handlers import http_exception_handler, request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from pydantic_core import PydanticCustomError
 
+from adaptive_limiter import LimiterOpenError
 from auth import require_ai_access, require_local_ai_access
 from config import settings
 from orchestrator import orchestrator
-from rate_limiter import enforce_rate_limit, remaining_requests
-from gmail_agent import GmailAgent
+from rate_limiter import enforce_rate_limit, rate_limit_exception, remaining_requests
+from gmail_agent import GmailAgent, build_email_contexts, token_bucket_budget
+from memoize import async_lru_ttl
 from local_qa_orchestrator import local_qa_orchestrator
 
 logging.basicConfig(level=logging.INFO)
@@ -41,10 +49,37 @@ FALLBACK_QUESTIONS = [
     "What timeline are you working with?",
 ]
 
+# Set on rate-limited AI responses so clients needn't poll /ai/status.
+_RATE_LIMIT_REMAINING_HEADER = "X-RateLimit-Remaining"
+
 MANDATORY_GUARDRAIL_QUESTION = "Do you have a 6-month emergency fund?"
+# Lowercased once for the case-insensitive comparisons in clarification selection.
+_FALLBACK_QUESTIONS_LC = [(question, question.lower()) for question in FALLBACK_QUESTIONS]
+_MANDATORY_GUARDRAIL_QUESTION_LC = MANDATORY_GUARDRAIL_QUESTION.lower()
 CLARIFICATION_MAX_ROUNDS = 4
 
-gmail_agent = GmailAgent(api_key=settings.ANTHROPIC_API_KEY)
+_gmail_agent: Optional[GmailAgent] = None
+
+
+def get_gmail_agent() -> GmailAgent:
+    """Create the Gmail agent (and its Anthropic HTTP client) on first use.
+
+    Construction never awaits, so concurrent first requests can't race here.
+    """
+    global _gmail_agent
+    if _gmail_agent is None:
+        requests_per_minute, tokens_per_minute = token_bucket_budget(
+            settings.GMAIL_AGENT_REQUESTS_PER_MINUTE,
+            settings.GMAIL_AGENT_TOKENS_PER_MINUTE,
+            settings.AI_RATE_LIMIT_PER_HOUR,
+        )
+        _gmail_agent = GmailAgent(
+            api_key=settings.ANTHROPIC_API_KEY,
+            cache_size=settings.GMAIL_AGENT_CACHE_SIZE,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+    return _gmail_agent
 
 
 def _debug_log(message: str, *args):
@@ -52,44 +87,204 @@ def _debug_log(message: str, *args):
         logger.info("[ai-debug] " + message, *args)
 
 
-def _extract_runway_months(text: str) -> Optional[float]:
-    years = re.findall(r"(\d+(?:\.\d+)?)\s*(?:year|years|yr|yrs)\b", text)
-    months = re.findall(r"(\d+(?:\.\d+)?)\s*(?:month|months|mo)\b", text)
-    values: list[float] = []
-    for item in years:
-        try:
-            values.append(float(item) * 12.0)
-        except ValueError:
-            continue
-    for item in months:
-        try:
-            values.append(float(item))
-        except ValueError:
-            continue
-    return max(values) if values else None
+# Identical clarification inputs (retries, resubmits, parallel tabs) reuse the
+# panel instead of re-running four Claude calls. Panels without a chosen
+# question are degraded fallbacks and are not cached; debug runs always hit
+# the model so logs reflect a live call.
+_generate_clarification_panel = async_lru_ttl(
+    maxsize=settings.AI_PANEL_CACHE_SIZE,
+    ttl=settings.AI_PANEL_CACHE_TTL,
+    should_cache=lambda panel: bool(panel.get("chosen_question")),
+    bypass=lambda: settings.AI_DEBUG_LOG,
+)(orchestrator.generate_clarification_panel)
+
+
+# Compiled once; a single pass over the text tags runway years, runway
+# months and "x/y" fractions via whichever named group matched. Both patterns
+# match case-insensitively so callers needn't lowercase a copy of the text.
+_GUARDRAIL_RE = re.compile(
+    r"(?P<yr>\d+(?:\.\d+)?)\s*(?:years?|yrs?)\b"
+    r"|(?P<mo>\d+(?:\.\d+)?)\s*(?:months?|mo)\b"
+    r"|(?P<num>\d+(?:\.\d+)?)\s*/\s*(?P<den>\d+(?:\.\d+)?)",
+    re.IGNORECASE,
+)
+# Every _GUARDRAIL_RE branch starts with a digit; a single C-level scan for one
+# lets digit-free answers ("yes", "no income") skip the alternation entirely.
+_DIGIT_RE = re.compile(r"\d")
+# One alternation scan instead of a separate substring search per phrase.
+_NO_INCOME_RE = re.compile("no income|career break|unemployed|between jobs", re.IGNORECASE)
 
 
-def _extract_fraction_ratio(text: str) -> Optional[float]:
-    matches = re.findall(r"(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)", text)
-    ratios: list[float] = []
-    for left, right in matches:
-        try:
-            denominator = float(right)
+# The final answer is already complete when streamed, so small slices only
+# multiply frames, JSON encodes and socket writes without arriving any sooner.
+_DELTA_CHUNK_CHARS = 2048
+
+
+def _delta_chunks(text: str, size: int = _DELTA_CHUNK_CHARS) -> Iterator[str]:
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+_SSE_KEEPALIVE_FRAME = b": ping\n\n"
+
+
+def _sse_frame(event: dict) -> bytes:
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+
+# Frames that never vary between /ai/query/stream requests, encoded once.
+_AI_DISCLAIMER = "AI responses are for informational purposes only."
+_AI_DISCLAIMER_FULL = (
+    _AI_DISCLAIMER + " Always verify important decisions with qualified professionals."
+)
+_META_FRAME_TEMPLATE = (
+    b'data: {"type":"meta","intent":%s,"query":%s,"agent":"JudgeBot","disclaimer":'
+    + orjson.dumps(_AI_DISCLAIMER)
+    + b"}\n\n"
+)
+_PROGRESS_COLLECT_FRAME = _sse_frame(
+    {"type": "progress", "stage": "collect_candidates", "message": "Consulting specialists..."}
+)
+_PROGRESS_RANK_FRAME = _sse_frame(
+    {"type": "progress", "stage": "rank_questions", "message": "Judge selecting best question..."}
+)
+_PROGRESS_FINAL_FRAME = _sse_frame(
+    {"type": "progress", "stage": "prepare_final", "message": "Synthesizing final answer..."}
+)
+_QUESTION_ERROR_FRAME = _sse_frame({"type": "error", "message": "Failed to generate question"})
+_DONE_CLARIFY_FRAME = _sse_frame({"type": "done", "mode": "clarify"})
+_DONE_FINAL_FRAME = _sse_frame({"type": "done", "mode": "final"})
+
+_LOCAL_QA_AGENT = "Photography & Art Consultant"
+_LOCAL_META_FRAME = _sse_frame(
+    {"type": "meta", "mode": "chat", "agent": _LOCAL_QA_AGENT, "disclaimer": _AI_DISCLAIMER_FULL}
+)
+_LOCAL_REJECTED_FRAME = _sse_frame(
+    {
+        "type": "rejected",
+        "message": (
+            "I can only help with art and photography topics in Q&A local. "
+            "Please ask about composition, lighting, camera settings, editing, or visual style."
+        ),
+        "agent": "Scope Guard",
+    }
+)
+_LOCAL_INTERRUPTED_FRAME = _sse_frame(
+    {"type": "error", "message": "Local AI stream interrupted. Please retry."}
+)
+_LOCAL_EMPTY_FRAME = _sse_frame({"type": "error", "message": "Local AI returned no content."})
+_DONE_CHAT_FRAME = _sse_frame({"type": "done", "mode": "chat"})
+
+
+def _model_response(model: BaseModel, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Serialize a response model in one pass.
+
+    Returning the model itself makes FastAPI validate it against
+    response_model again before encoding. AIQueryResponse is built with
+    model_construct from server-produced fields, so it is never validated.
+    """
+    return Response(
+        content=model.model_dump_json(), media_type="application/json", headers=headers
+    )
+
+
+def _clarify_event(fields: dict[str, Any]) -> bytes:
+    """Encode _resolve_next_clarify fields as a clarify_question stream event."""
+    return _sse_frame(
+        {
+            "type": "clarify_question",
+            **fields,
+            "clarification_state": fields["clarification_state"].model_dump(),
+            "agent": "JudgeBot",
+            "disclaimer": _AI_DISCLAIMER,
+        }
+    )
+
+
+async def _with_sse_keepalive(events: AsyncIterator[bytes], interval: float) -> AsyncIterator[bytes]:
+    """Relay SSE frames, emitting a comment frame whenever the source is silent.
+
+    Clarification rounds wait on several LLM calls before their first event;
+    the pings keep proxies from timing out idle connections meanwhile.
+    """
+    pending = asyncio.ensure_future(events.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield _SSE_KEEPALIVE_FRAME
+                continue
+            try:
+                frame = pending.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+            pending = asyncio.ensure_future(events.__anext__())
+    finally:
+        if not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        await events.aclose()
+
+
+def _event_stream_response(
+    events: AsyncIterator[bytes], headers: Optional[Dict[str, str]] = None
+) -> StreamingResponse:
+    """Wrap an SSE frame generator in a proxy-safe text/event-stream response."""
+    interval = settings.AI_SSE_KEEPALIVE_SECONDS
+    if interval > 0:
+        events = _with_sse_keepalive(events, interval)
+    if headers:
+        headers = {**_SSE_HEADERS, **headers}
+    return StreamingResponse(
+        events, media_type="text/event-stream", headers=headers or _SSE_HEADERS
+    )
+
+
+def _claude_rate_limit_exception(exc: LimiterOpenError) -> HTTPException:
+    """The per-user 429, carrying how long Claude calls stay paused."""
+    return rate_limit_exception(math.ceil(exc.retry_after))
+
+
+def _extract_runway_and_ratio(text: str) -> tuple[Optional[float], Optional[float]]:
+    """Return (longest runway in months, smallest x/y ratio) found in text."""
+    runway_months: Optional[float] = None
+    ratio: Optional[float] = None
+    for match in _GUARDRAIL_RE.finditer(text):
+        years, months, numerator = match.group("yr", "mo", "num")
+        if years is not None:
+            value = float(years) * 12.0
+        elif months is not None:
+            value = float(months)
+        else:
+            denominator = float(match.group("den"))
             if denominator <= 0:
                 continue
-            ratios.append(float(left) / denominator)
-        except ValueError:
+            value = float(numerator) / denominator
+            if ratio is None or value < ratio:
+                ratio = value
             continue
-    return min(ratios) if ratios else None
+        if runway_months is None or value > runway_months:
+            runway_months = value
+    return runway_months, ratio
 
 
 def _build_smart_guardrail_question(original_query: str, answers: list[str]) -> tuple[str, str]:
     """Build a contextual 4th guardrail question for affordability intent."""
     combined = f"{original_query}\n" + "\n".join(answers)
-    lower = combined.lower()
-    runway_months = _extract_runway_months(lower)
-    ratio = _extract_fraction_ratio(lower)
-    no_income = any(token in lower for token in ["no income", "career break", "unemployed", "between jobs"])
+    if _DIGIT_RE.search(combined) is None:
+        runway_months = ratio = None
+    else:
+        runway_months, ratio = _extract_runway_and_ratio(combined)
+    no_income = _NO_INCOME_RE.search(combined) is not None
 
     if no_income and runway_months is not None and runway_months >= 24 and ratio is not None and ratio <= 0.05:
         return (
@@ -115,6 +310,14 @@ def _build_smart_guardrail_question(original_query: str, answers: list[str]) ->
     )
 
 
+# Error type for AIQueryRequest invariants; surfaced as 400 with a string detail.
+_QUERY_ERROR_TYPE = "ai_query_invalid"
+
+
+def _reject_query(message: str) -> None:
+    raise PydanticCustomError(_QUERY_ERROR_TYPE, message)
+
+
 # ---------------------------------------------------------------------------
 # Pydantic Models
 # ---------------------------------------------------------------------------
@@ -126,6 +329,9 @@ class ClarificationState(BaseModel):
     fallback_flags: Optional[list[bool]] = None
     max_rounds: int = 3
 
+    # Echoed back verbatim by the client; handlers derive new states, never mutate.
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
 
 class AIQueryRequest(BaseModel):
     intent: str
@@ -134,7 +340,39 @@ class AIQueryRequest(BaseModel):
     conversation_stage: Literal["initial", "clarification"] = "initial"
     clarification_state: Optional[ClarificationState] = None
 
-    model_config = {"extra": "forbid"}
+    model_config = ConfigDict(extra="forbid")
+
+    @model_validator(mode="after")
+    def _check_query(self) -> "AIQueryRequest":
+        # Cheapest gate first: reject oversized input before any copy.
+        query = self.query
+        query_len = len(query)
+        if query_len > 1000:
+            _reject_query("Query too long. Please keep it under 1000 characters.")
+        if self.media_urls:
+            _reject_query("Media inputs are not supported for AI queries.")
+
+        # Only padded queries need a stripped copy to measure.
+        if query[:1].isspace() or query[-1:].isspace():
+            query_len = len(query.strip())
+        if not query_len:
+            _reject_query("Query cannot be empty.")
+
+        if self.conversation_stage == "initial":
+            if query_len < 10:
+                _reject_query("Query too short. Please provide more details.")
+            return self
+
+        state = self.clarification_state
+        if state is None:
+            _reject_query("clarification_state is required during clarification stage.")
+        if not state.questions:
+            _reject_query("clarification_state.questions cannot be empty.")
+        if state.max_rounds < 1 or state.max_rounds > CLARIFICATION_MAX_ROUNDS:
+            _reject_query(
+                f"clarification_state.max_rounds must be between 1 and {CLARIFICATION_MAX_ROUNDS}."
+            )
+        return self
 
 
 class AIQueryResponse(BaseModel):
@@ -155,10 +393,7 @@ class AIQueryResponse(BaseModel):
     clarification_state: Optional[ClarificationState] = None
     response: Optional[str] = None
     agent: str
-    disclaimer: str = (
-        "AI responses are for informational purposes only. "
-        "Always verify important decisions with qualified professionals."
-    )
+    disclaimer: str = _AI_DISCLAIMER_FULL
 
 
 class GmailSummaryRequest(BaseModel):
@@ -200,55 +435,10 @@ class LocalAIQueryResponse(BaseModel):
     rejected: bool = False
 
 
-# ---------------------------------------------------------------------------
-# Validation helper
-# ---------------------------------------------------------------------------
-
-def _validate_query(request: AIQueryRequest):
-    if request.media_urls:
-        raise HTTPException(
-            status_code=400,
-            detail="Media inputs are not supported for AI queries.",
-        )
-
-    query_text = request.query.strip()
-    if not query_text:
-        raise HTTPException(status_code=400, detail="Query cannot be empty.")
-
-    if request.conversation_stage == "initial" and len(query_text) < 10:
-        raise HTTPException(
-            status_code=400,
-            detail="Query too short. Please provide more details.",
-        )
-
-    if len(request.query) > 1000:
-        raise HTTPException(
-            status_code=400,
-            detail="Query too long. Please keep it under 1000 characters.",
-        )
-
-    if request.conversation_stage == "clarification":
-        if request.clarification_state is None:
-            raise HTTPException(
-                status_code=400,
-                detail="clarification_state is required during clarification stage.",
-            )
-        if not request.clarification_state.questions:
-            raise HTTPException(
-                status_code=400,
-                detail="clarification_state.questions cannot be empty.",
-            )
-        if request.clarification_state.max_rounds < 1 or request.clarification_state.max_rounds > CLARIFICATION_MAX_ROUNDS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"clarification_state.max_rounds must be between 1 and {CLARIFICATION_MAX_ROUNDS}.",
-            )
-
-
-def _next_fallback_question(asked_questions: list[str]) -> Optional[str]:
-    asked = {q.strip().lower() for q in asked_questions if q.strip()}
-    for question in FALLBACK_QUESTIONS:
-        if question.lower() not in asked:
+def _next_fallback_question(asked_norm: set[str]) -> Optional[str]:
+    """First fallback question not already asked; asked_norm is stripped + lowercased."""
+    for question, question_norm in _FALLBACK_QUESTIONS_LC:
+        if question_norm not in asked_norm:
             return question
     return None
 
@@ -265,7 +455,7 @@ async def _select_next_clarification_question(
     if (
         intent == "afford"
         and len(answers) == CLARIFICATION_MAX_ROUNDS - 1
-        and MANDATORY_GUARDRAIL_QUESTION.lower() not in asked_norm
+        and _MANDATORY_GUARDRAIL_QUESTION_LC not in asked_norm
     ):
         guardrail_question, guardrail_reason = _build_smart_guardrail_question(original_query, answers)
         _debug_log("guardrail question selected: %s", guardrail_question)
@@ -279,7 +469,7 @@ async def _select_next_clarification_question(
             {"Guardrail": guardrail_reason},
         )
 
-    panel = await orchestrator.generate_clarification_panel(
+    panel = await _generate_clarification_panel(
         intent=intent,
         user_original_query=original_query,
         asked_questions=asked_questions,
@@ -290,32 +480,58 @@ async def _select_next_clarification_question(
     chosen_question_raw = panel.get("chosen_question")
     chosen_question = chosen_question_raw if isinstance(chosen_question_raw, str) else ""
     chosen_question = chosen_question.strip()
-    if len(answers) < CLARIFICATION_MAX_ROUNDS - 1 and chosen_question.lower() == MANDATORY_GUARDRAIL_QUESTION.lower():
+    if len(answers) < CLARIFICATION_MAX_ROUNDS - 1 and chosen_question.lower() == _MANDATORY_GUARDRAIL_QUESTION_LC:
         chosen_question = ""
     if chosen_question:
         panel_others_raw = panel.get("other_suggested_questions")
-        panel_others: list[str] = [
-            item
-            for item in panel_others_raw
-            if isinstance(item, str)
-            and item.strip().lower() != MANDATORY_GUARDRAIL_QUESTION.lower()
-        ] if isinstance(panel_others_raw, list) else []
+        panel_others: list[str] = []
+        if isinstance(panel_others_raw, list):
+            # Normalize each candidate once; drop the guardrail question,
+            # anything already asked and duplicates the model repeated.
+            seen_norm = {_MANDATORY_GUARDRAIL_QUESTION_LC}
+            for item in panel_others_raw:
+                if not isinstance(item, str):
+                    continue
+                item_norm = item.strip().lower()
+                if item_norm in seen_norm or item_norm in asked_norm:
+                    continue
+                seen_norm.add(item_norm)
+                panel_others.append(item)
         panel_reasoning_raw = panel.get("judge_reasoning")
         panel_reasoning = panel_reasoning_raw.strip() if isinstance(panel_reasoning_raw, str) else ""
         panel_chosen_raw = panel.get("chosen_from_agent")
         panel_chosen = panel_chosen_raw if isinstance(panel_chosen_raw, str) else "JudgeBot"
+        # The orchestrator normally returns well-typed maps; reuse them as-is
+        # (they are only read downstream) and rebuild only on mixed types.
         panel_agents_raw = panel.get("agent_candidates")
         panel_agents: dict[str, list[str]] = {}
         if isinstance(panel_agents_raw, dict):
-            for key, value in panel_agents_raw.items():
-                if isinstance(key, str) and isinstance(value, list):
-                    panel_agents[key] = [item for item in value if isinstance(item, str)]
+            if all(
+                isinstance(key, str)
+                and isinstance(value, list)
+                and all(isinstance(item, str) for item in value)
+                for key, value in panel_agents_raw.items()
+            ):
+                panel_agents = panel_agents_raw
+            else:
+                for key, value in panel_agents_raw.items():
+                    if isinstance(key, str) and isinstance(value, list):
+                        panel_agents[key] = [item for item in value if isinstance(item, str)]
         panel_reasoning_raw_map = panel.get("agent_reasoning")
         panel_agent_reasoning: dict[str, str] = {}
         if isinstance(panel_reasoning_raw_map, dict):
-            for key, value in panel_reasoning_raw_map.items():
-                if isinstance(key, str) and isinstance(value, str):
-                    panel_agent_reasoning[key] = value.strip()
+            if all(
+                isinstance(key, str)
+                and isinstance(value, str)
+                and not value[:1].isspace()
+                and not value[-1:].isspace()
+                for key, value in panel_reasoning_raw_map.items()
+            ):
+                panel_agent_reasoning = panel_reasoning_raw_map
+            else:
+                for key, value in panel_reasoning_raw_map.items():
+                    if isinstance(key, str) and isinstance(value, str):
+                        panel_agent_reasoning[key] = value.strip()
 
         return (
             chosen_question,
@@ -327,11 +543,10 @@ async def _select_next_clarification_question(
             panel_agent_reasoning,
         )
 
-    fallback = _next_fallback_question(asked_questions)
+    fallback = _next_fallback_question(asked_norm)
     if fallback:
         fallback_candidates = []
-        for question in FALLBACK_QUESTIONS:
-            question_norm = question.lower()
+        for question, question_norm in _FALLBACK_QUESTIONS_LC:
             if question_norm in asked_norm or question == fallback:
                 continue
             fallback_candidates.append(question)
@@ -350,21 +565,122 @@ async def _select_next_clarification_question(
     return None, False, [], "", "JudgeBot", {}, {}
 
 
+def _clarification_answers(state: ClarificationState, query: str) -> list[str]:
+    """Answers so far; the latest query answers the last question if still open."""
+    if len(state.answers) < len(state.questions):
+        return [*state.answers, query]
+    return state.answers
+
+
+async def _resolve_next_clarify(
+    intent: str,
+    query: str,
+    state: Optional[ClarificationState],
+    answers: list[str],
+) -> Optional[dict[str, Any]]:
+    """Pick the next question and build the clarify fields both /ai/query endpoints send.
+
+    state is None for the initial round. Returns None when no question could
+    be produced; the caller decides how to finish.
+    """
+    original_query = state.original_query if state is not None else query
+    (
+        question,
+        is_fallback,
+        others,
+        reasoning,
+        chosen_from,
+        agents,
+        agent_reasoning,
+    ) = await _select_next_clarification_question(
+        intent,
+        original_query,
+        state.questions if state is not None else [],
+        answers,
+    )
+    if not question:
+        return None
+
+    if state is None:
+        # Built from already-validated request fields and fresh panel output,
+        # so skip the validator walk.
+        new_state = ClarificationState.model_construct(
+            original_query=query,
+            questions=[question],
+            answers=[],
+            fallback_flags=[is_fallback],
+            max_rounds=CLARIFICATION_MAX_ROUNDS,
+        )
+    else:
+        # One structured copy of the frozen incoming state.
+        new_state = state.model_copy(
+            update={
+                "questions": [*state.questions, question],
+                "answers": answers,
+                "fallback_flags": [*(state.fallback_flags or []), is_fallback],
+            }
+        )
+
+    return {
+        "intent": intent,
+        "query": query,
+        "question": question,
+        "questions": new_state.questions,
+        "candidate_questions": others,
+        "other_suggested_questions": others,
+        "agent_candidates": agents,
+        "agent_reasoning": agent_reasoning,
+        "judge_reasoning": reasoning,
+        "chosen_from_agent": chosen_from,
+        "current_round": len(new_state.questions),
+        "total_rounds": new_state.max_rounds,
+        "is_fallback_question": is_fallback,
+        "clarification_state": new_state,
+    }
+
+
 # ---------------------------------------------------------------------------
 # FastAPI App
 # ---------------------------------------------------------------------------
 
-app = FastAPI(title="AI Service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the Anthropic client before the first request and drain its
+    # connection pools when the worker stops.
+    orchestrator.initialize()
+    yield
+    await orchestrator.aclose()
+    if _gmail_agent is not None:
+        await _gmail_agent.client.close()
+
+
+app = FastAPI(title="AI Service", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.ALLOWED_ORIGINS.split(","),
+    allow_origins=settings.allowed_origins_list,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[_RATE_LIMIT_REMAINING_HEADER],
 )
 
 
+@app.exception_handler(RequestValidationError)
+async def _query_validation_handler(request: Request, exc: RequestValidationError):
+    # Keep the 400 + string detail contract the frontend renders for bad queries.
+    for error in exc.errors():
+        if error.get("type") == _QUERY_ERROR_TYPE:
+            return JSONResponse(status_code=400, content={"detail": error["msg"]})
+    return await request_validation_exception_handler(request, exc)
+
+
+@app.exception_handler(LimiterOpenError)
+async def _claude_rate_limit_handler(request: Request, exc: LimiterOpenError):
+    # Same 429 body and Retry-After as the per-user limit, so clients back off alike.
+    return await http_exception_handler(request, _claude_rate_limit_exception(exc))
+
+
 @app.get("/healthz")
 async def healthz():
     """K8s probe endpoint."""
@@ -489,46 +805,24 @@ async def query_local_ai_stream(
     ]
 
     async def event_generator():
-        def sse(event: dict) -> str:
-            return f"data: {json.dumps(event)}\n\n"
-
-        assistant_agent = "Photography & Art Consultant"
-        yield sse(
-            {
-                "type": "meta",
-                "mode": "chat",
-                "agent": assistant_agent,
-                "disclaimer": (
-                    "AI responses are for informational purposes only. "
-                    "Always verify important decisions with qualified professionals."
-                ),
-            }
-        )
+        assistant_agent = _LOCAL_QA_AGENT
+        yield _LOCAL_META_FRAME
 
         if not local_qa_orchestrator.is_supported_topic(query_text):
-            yield sse(
-                {
-                    "type": "rejected",
-                    "message": (
-                        "I can only help with art and photography topics in Q&A local. "
-                        "Please ask about composition, lighting, camera settings, editing, or visual style."
-                    ),
-                    "agent": "Scope Guard",
-                }
-            )
-            yield sse({"type": "done", "mode": "chat"})
+            yield _LOCAL_REJECTED_FRAME
+            yield _DONE_CHAT_FRAME
             return
 
         model_name = await local_qa_orchestrator.resolve_model_name()
         if not model_name:
-            yield sse(
+            yield _sse_frame(
                 {
                     "type": "fallback",
                     "message": local_qa_orchestrator.fallback_message(),
                     "agent": "System",
                 }
             )
-            yield sse({"type": "done", "mode": "chat"})
+            yield _DONE_CHAT_FRAME
             return
 
         token_sent = False
@@ -542,35 +836,27 @@ async def query_local_ai_stream(
                     logger.info("Client disconnected from /ai/local/query/stream")
                     return
                 token_sent = True
-                yield sse({"type": "delta", "text": token, "agent": assistant_agent})
+                yield _sse_frame({"type": "delta", "text": token, "agent": assistant_agent})
         except Exception:
             logger.exception("Local AI streaming failed for /ai/local/query/stream")
             if token_sent:
-                yield sse({"type": "error", "message": "Local AI stream interrupted. Please retry."})
+                yield _LOCAL_INTERRUPTED_FRAME
             else:
-                yield sse(
+                yield _sse_frame(
                     {
                         "type": "fallback",
                         "message": local_qa_orchestrator.fallback_message(),
                         "agent": "System",
                     }
                 )
-            yield sse({"type": "done", "mode": "chat"})
+            yield _DONE_CHAT_FRAME
             return
 
         if not token_sent:
-            yield sse({"type": "error", "message": "Local AI returned no content."})
-        yield sse({"type": "done", "mode": "chat"})
+            yield _LOCAL_EMPTY_FRAME
+        yield _DONE_CHAT_FRAME
 
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
-    )
+    return _event_stream_response(event_generator())
 
 
 @app.post("/ai/query", response_model=AIQueryResponse)
@@ -579,12 +865,14 @@ async def query_ai_agents(
     username: str = Depends(require_ai_access),
 ):
     """Query the AI agents with a specific intent (allowlist users only)."""
-    await enforce_rate_limit(
+    # Don't spend the caller's hourly budget while Claude is refusing calls.
+    orchestrator.check_claude_available()
+    remaining = await enforce_rate_limit(
         user_id=username,
         max_requests=settings.AI_RATE_LIMIT_PER_HOUR,
         window_seconds=3600,
     )
-    _validate_query(request)
+    rate_limit_headers = {_RATE_LIMIT_REMAINING_HEADER: str(remaining)}
 
     intent = request.intent
     if intent not in ["afford", "learn"]:
@@ -592,148 +880,48 @@ async def query_ai_agents(
 
     if request.conversation_stage == "initial":
         # Initial query: generate the first clarification question
-        (
-            question,
-            is_fallback,
-            others,
-            reasoning,
-            chosen_from,
-            agents,
-            agent_reasoning,
-        ) = await _select_next_clarification_question(intent, request.query, [], [])
-
-        if not question:
+        fields = await _resolve_next_clarify(intent, request.query, None, [])
+        if fields is None:
             # Should not happen ideally, but if no question is generated, fallback or fail
             raise HTTPException(status_code=500, detail="Failed to generate clarification question.")
+        return _model_response(
+            AIQueryResponse.model_construct(mode="clarify", agent="JudgeBot", **fields),
+            headers=rate_limit_headers,
+        )
+
+    # Clarification stage: the client sends its latest answer as `query`.
+    state = request.clarification_state
+    if not state:
+        raise HTTPException(status_code=400, detail="Missing clarification state")
+
+    answers = _clarification_answers(state, request.query)
+
+    # Ask the next question until max_rounds answers are in (or none is left).
+    fields = None
+    if len(answers) < state.max_rounds:
+        fields = await _resolve_next_clarify(intent, request.query, state, answers)
+    if fields is not None:
+        return _model_response(
+            AIQueryResponse.model_construct(mode="clarify", agent="JudgeBot", **fields),
+            headers=rate_limit_headers,
+        )
 
-        return AIQueryResponse(
-            mode="clarify",
+    final_response = await orchestrator.generate_final_response(
+        intent=intent,
+        original_query=state.original_query,
+        questions=state.questions,
+        answers=answers,
+    )
+    return _model_response(
+        AIQueryResponse.model_construct(
+            mode="final",
             intent=intent,
             query=request.query,
-            question=question,
-            questions=[question],
-            candidate_questions=others,
-            other_suggested_questions=others,
-            agent_candidates=agents,
-            agent_reasoning=agent_reasoning,
-            judge_reasoning=reasoning,
-            chosen_from_agent=chosen_from,
-            current_round=1,
-            total_rounds=CLARIFICATION_MAX_ROUNDS,
-            is_fallback_question=is_fallback,
-            clarification_state=ClarificationState(
-                original_query=request.query,
-                questions=[question],
-                answers=[],
-                fallback_flags=[is_fallback],
-                max_rounds=CLARIFICATION_MAX_ROUNDS,
-            ),
+            response=final_response,
             agent="JudgeBot",
-        )
-
-    else:
-        # Clarification stage
-        state = request.clarification_state
-        if not state:
-            raise HTTPException(status_code=400, detail="Missing clarification state")
-
-        # Check if we have gathered all answers
-        # If the user just submitted an answer to the last question:
-        # (Client should append the answer to state.answers before sending, or we assume the query IS the answer?
-        # The contract implies 'query' is the user's latest input.
-        # But for 'clarification' stage, usually we expect the client to have updated the state?
-        # Let's assume the client sends the *latest answer* as `query`, and we append it.)
-        
-        # Actually, looking at the frontend, it sends `query` as the answer.
-        # But `AIChannel.tsx` builds the `clarificationState` by appending answers locally?
-        # Wait, `queryAI` just passes the state.
-        
-        # Let's look at `_validate_query`. It expects `state` to be present.
-        # If `answers` length < `questions` length, `query` is the answer to `questions[-1]`.
-        
-        answers = list(state.answers)
-        if len(answers) < len(state.questions):
-            answers.append(request.query)
-        
-        # If we have enough answers, generate final response OR next question
-        if len(answers) >= state.max_rounds:
-            # Generate final response
-            final_response = await orchestrator.generate_final_response(
-                intent=intent,
-                original_query=state.original_query,
-                questions=state.questions,
-                answers=answers,
-            )
-            return AIQueryResponse(
-                mode="final",
-                intent=intent,
-                query=request.query,
-                response=final_response,
-                agent="JudgeBot",
-            )
-        else:
-            # Generate next question
-            (
-                question,
-                is_fallback,
-                others,
-                reasoning,
-                chosen_from,
-                agents,
-                agent_reasoning,
-            ) = await _select_next_clarification_question(
-                intent,
-                state.original_query,
-                state.questions,
-                answers,
-            )
-
-            if not question:
-                # No more questions generated? Proceed to final response early?
-                final_response = await orchestrator.generate_final_response(
-                    intent=intent,
-                    original_query=state.original_query,
-                    questions=state.questions,
-                    answers=answers,
-                )
-                return AIQueryResponse(
-                    mode="final",
-                    intent=intent,
-                    query=request.query,
-                    response=final_response,
-                    agent="JudgeBot",
-                )
-
-            # Update state
-            new_questions = list(state.questions)
-            new_questions.append(question)
-            new_fallback_flags = list(state.fallback_flags or [])
-            new_fallback_flags.append(is_fallback)
-
-            return AIQueryResponse(
-                mode="clarify",
-                intent=intent,
-                query=request.query,
-                question=question,
-                questions=new_questions,
-                candidate_questions=others,
-                other_suggested_questions=others,
-                agent_candidates=agents,
-                agent_reasoning=agent_reasoning,
-                judge_reasoning=reasoning,
-                chosen_from_agent=chosen_from,
-                current_round=len(new_questions),
-                total_rounds=state.max_rounds,
-                is_fallback_question=is_fallback,
-                clarification_state=ClarificationState(
-                    original_query=state.original_query,
-                    questions=new_questions,
-                    answers=answers,
-                    fallback_flags=new_fallback_flags,
-                    max_rounds=state.max_rounds,
-                ),
-                agent="JudgeBot",
-            )
+        ),
+        headers=rate_limit_headers,
+    )
 
 
 @app.post("/ai/query/stream")
@@ -742,12 +930,12 @@ async def query_ai_agents_stream(
     username: str = Depends(require_ai_access),
 ):
     """Stream AI response (SSE)."""
-    await enforce_rate_limit(
+    orchestrator.check_claude_available()
+    remaining = await enforce_rate_limit(
         user_id=username,
         max_requests=settings.AI_RATE_LIMIT_PER_HOUR,
         window_seconds=3600,
     )
-    _validate_query(request)
 
     intent = request.intent
     if intent not in ["afford", "learn"]:
@@ -759,141 +947,53 @@ async def query_ai_agents_stream(
 
     async def event_generator():
         # Emit meta event
-        yield f"data: {json.dumps({'type': 'meta', 'intent': intent, 'query': request.query, 'agent': 'JudgeBot', 'disclaimer': 'AI responses are for informational purposes only.'})}\n\n"
-
-        if request.conversation_stage == "initial":
-            yield f"data: {json.dumps({'type': 'progress', 'stage': 'collect_candidates', 'message': 'Consulting specialists...'})}\n\n"
-            
-            (
-                question,
-                is_fallback,
-                others,
-                reasoning,
-                chosen_from,
-                agents,
-                agent_reasoning,
-            ) = await _select_next_clarification_question(intent, request.query, [], [])
-
-            if not question:
-                yield f"data: {json.dumps({'type': 'error', 'message': 'Failed to generate question'})}\n\n"
-                return
+        yield _META_FRAME_TEMPLATE % (orjson.dumps(intent), orjson.dumps(request.query))
+        try:
+            if request.conversation_stage == "initial":
+                yield _PROGRESS_COLLECT_FRAME
+                fields = await _resolve_next_clarify(intent, request.query, None, [])
+                if fields is None:
+                    yield _QUESTION_ERROR_FRAME
+                    return
 
-            yield f"data: {json.dumps({'type': 'progress', 'stage': 'rank_questions', 'message': 'Judge selecting best question...'})}\n\n"
-
-            response_data = {
-                "type": "clarify_question",
-                "intent": intent,
-                "query": request.query,
-                "question": question,
-                "questions": [question],
-                "candidate_questions": others,
-                "other_suggested_questions": others,
-                "agent_candidates": agents,
-                "agent_reasoning": agent_reasoning,
-                "judge_reasoning": reasoning,
-                "chosen_from_agent": chosen_from,
-                "current_round": 1,
-                "total_rounds": CLARIFICATION_MAX_ROUNDS,
-                "is_fallback_question": is_fallback,
-                "clarification_state": {
-                    "original_query": request.query,
-                    "questions": [question],
-                    "answers": [],
-                    "fallback_flags": [is_fallback],
-                    "max_rounds": CLARIFICATION_MAX_ROUNDS,
-                },
-                "agent": "JudgeBot",
-                "disclaimer": "AI responses are for informational purposes only."
-            }
-            yield f"data: {json.dumps(response_data)}\n\n"
-            yield f"data: {json.dumps({'type': 'done', 'mode': 'clarify'})}\n\n"
+                yield _PROGRESS_RANK_FRAME
+                yield _clarify_event(fields)
+                yield _DONE_CLARIFY_FRAME
+                return
 
-        else:
             # Clarification stage logic
             state = request.clarification_state
-            answers = list(state.answers)
-            if len(answers) < len(state.questions):
-                answers.append(request.query)
-
-            if len(answers) >= state.max_rounds:
-                yield f"data: {json.dumps({'type': 'progress', 'stage': 'prepare_final', 'message': 'Synthesizing final answer...'})}\n\n"
-                final_response = await orchestrator.generate_final_response(
-                    intent=intent,
-                    original_query=state.original_query,
-                    questions=state.questions,
-                    answers=answers,
-                )
-                # Stream delta (simulate)
-                chunk_size = 20
-                for i in range(0, len(final_response), chunk_size):
-                    chunk = final_response[i:i+chunk_size]
-                    yield f"data: {json.dumps({'type': 'delta', 'text': chunk})}\n\n"
-                
-                yield f"data: {json.dumps({'type': 'done', 'mode': 'final'})}\n\n"
-            else:
-                yield f"data: {json.dumps({'type': 'progress', 'stage': 'collect_candidates', 'message': 'Consulting specialists...'})}\n\n"
-                (
-                    question,
-                    is_fallback,
-                    others,
-                    reasoning,
-                    chosen_from,
-                    agents,
-                    agent_reasoning,
-                ) = await _select_next_clarification_question(
-                    intent,
-                    state.original_query,
-                    state.questions,
-                    answers,
-                )
-
-                if not question:
-                     # Fallback to final response if no question
-                    final_response = await orchestrator.generate_final_response(
-                        intent=intent,
-                        original_query=state.original_query,
-                        questions=state.questions,
-                        answers=answers,
-                    )
-                    for i in range(0, len(final_response), 20):
-                        yield f"data: {json.dumps({'type': 'delta', 'text': final_response[i:i+20]})}\n\n"
-                    yield f"data: {json.dumps({'type': 'done', 'mode': 'final'})}\n\n"
+            answers = _clarification_answers(state, request.query)
+
+            if len(answers) < state.max_rounds:
+                yield _PROGRESS_COLLECT_FRAME
+                fields = await _resolve_next_clarify(intent, request.query, state, answers)
+                if fields is not None:
+                    yield _clarify_event(fields)
+                    yield _DONE_CLARIFY_FRAME
                     return
+                # Fallback to final response if no question
+            else:
+                yield _PROGRESS_FINAL_FRAME
 
-                new_questions = list(state.questions)
-                new_questions.append(question)
-                new_fallback_flags = list(state.fallback_flags or [])
-                new_fallback_flags.append(is_fallback)
-
-                response_data = {
-                    "type": "clarify_question",
-                    "intent": intent,
-                    "query": request.query,
-                    "question": question,
-                    "questions": new_questions,
-                    "candidate_questions": others,
-                    "other_suggested_questions": others,
-                    "agent_candidates": agents,
-                    "agent_reasoning": agent_reasoning,
-                    "judge_reasoning": reasoning,
-                    "chosen_from_agent": chosen_from,
-                    "current_round": len(new_questions),
-                    "total_rounds": state.max_rounds,
-                    "is_fallback_question": is_fallback,
-                    "clarification_state": {
-                        "original_query": state.original_query,
-                        "questions": new_questions,
-                        "answers": answers,
-                        "fallback_flags": new_fallback_flags,
-                        "max_rounds": state.max_rounds,
-                    },
-                    "agent": "JudgeBot",
-                    "disclaimer": "AI responses are for informational purposes only."
-                }
-                yield f"data: {json.dumps(response_data)}\n\n"
-                yield f"data: {json.dumps({'type': 'done', 'mode': 'clarify'})}\n\n"
-
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+            final_response = await orchestrator.generate_final_response(
+                intent=intent,
+                original_query=state.original_query,
+                questions=state.questions,
+                answers=answers,
+            )
+            # Stream delta (simulate)
+            for chunk in _delta_chunks(final_response):
+                yield _sse_frame({"type": "delta", "text": chunk})
+            yield _DONE_FINAL_FRAME
+        except LimiterOpenError as exc:
+            # Headers are already sent; report the 429 body as an error event.
+            yield _sse_frame({"type": "error", **_claude_rate_limit_exception(exc).detail})
+
+    return _event_stream_response(
+        event_generator(),
+        headers={_RATE_LIMIT_REMAINING_HEADER: str(remaining)},
+    )
 
 
 @app.post("/ai/gmail/questions", response_model=GmailQuestionsResponse)
@@ -908,7 +1008,7 @@ async def generate_gmail_questions(
         window_seconds=3600,
     )
     
-    questions = await gmail_agent.generate_followup_questions(
+    questions = await get_gmail_agent().generate_followup_questions(
         interest=request.interest,
         previous_answers=request.previous_answers
     )
@@ -927,18 +1027,10 @@ async def generate_gmail_summary(
         window_seconds=3600,
     )
     
-    # 1. Generate dual summaries
-    summaries = await gmail_agent.generate_summaries(
-        emails=request.emails,
-        interest=request.interest,
-        answers=request.answers
-    )
-    
-    # 2. Judge and rank
-    result = await gmail_agent.judge_and_rank(
-        emails=request.emails,
-        summary_a=summaries.get("summary_a", ""),
-        summary_b=summaries.get("summary_b", ""),
+    # Summaries, judging and ranking in one Claude round-trip
+    # (the agent falls back to the staged calls on a bad reply).
+    result = await get_gmail_agent().run_full_pipeline(
+        emails=build_email_contexts(request.emails),
         interest=request.interest,
         answers=request.answers
     )
@@ -0,0 +1,98 @@
+"""Bounded TTL memoization for expensive coroutine calls (LLM round-trips).
+
+Results are keyed by a BLAKE2b digest of the JSON-encoded call arguments, so
+arguments must be JSON-serializable (strings, numbers, lists, dicts).
+Identical calls that overlap share one in-flight run instead of each missing
+the cache and calling the model.
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from cachetools import TTLCache
+
+T = TypeVar("T")
+
+
+def _call_key(args: tuple, kwargs: dict) -> bytes:
+    encoded = json.dumps([args, kwargs], sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode(), digest_size=16).digest()
+
+
+def join_inflight(
+    inflight: "Dict[Hashable, asyncio.Future[T]]",
+    key: Hashable,
+    start: Callable[[], Awaitable[T]],
+    on_result: Callable[[T], None],
+) -> "asyncio.Future[T]":
+    """Wait on the in-flight call for ``key``, starting it with ``start`` if none is running.
+
+    ``on_result`` runs once with a successful result, before any waiter
+    resumes, so it can fill a cache. Failures reach every waiter and are not
+    passed to ``on_result``.
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(start())
+        inflight[key] = task
+
+        def _finish(done: "asyncio.Future[T]") -> None:
+            inflight.pop(key, None)
+            if not done.cancelled() and done.exception() is None:
+                on_result(done.result())
+
+        task.add_done_callback(_finish)
+    # Shielded so one caller's cancellation (client disconnect) does not
+    # cancel the call for everyone else waiting on it.
+    return asyncio.shield(task)
+
+
+def async_lru_ttl(
+    maxsize: int = 256,
+    ttl: float = 300,
+    *,
+    should_cache: Optional[Callable[[Any], bool]] = None,
+    bypass: Optional[Callable[[], bool]] = None,
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Cache a coroutine function's results for ``ttl`` seconds, LRU-bounded.
+
+    ``should_cache`` can reject results (e.g. degraded fallbacks) so they are
+    retried next time; ``bypass`` is checked per call and skips the cache
+    entirely when it returns True. A non-positive maxsize or ttl disables
+    caching. Exceptions are never cached. Concurrent identical calls share
+    one run of ``func`` via join_inflight.
+    """
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        if maxsize <= 0 or ttl <= 0:
+            return func
+
+        cache: "TTLCache[bytes, Any]" = TTLCache(maxsize=maxsize, ttl=ttl)
+        inflight: "Dict[Hashable, asyncio.Future[Any]]" = {}
+
+        def _store(key: bytes, result: Any) -> None:
+            if result is not None and (should_cache is None or should_cache(result)):
+                cache[key] = result
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            if bypass is not None and bypass():
+                return await func(*args, **kwargs)
+            key = _call_key(args, kwargs)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            return await join_inflight(
+                inflight,
+                key,
+                lambda: func(*args, **kwargs),
+                functools.partial(_store, key),
+            )
+
+        wrapper.cache = cache  # type: ignore[attr-defined]
+        return wrapper
+
+    return decorator
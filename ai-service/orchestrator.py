@@ -6,12 +6,113 @@ that synthesizes their responses into a single recommendation.
 """
 
 import asyncio
-import json
-from typing import Any, AsyncGenerator, Optional
+import contextlib
+import functools
+import hashlib
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Mapping, Optional
 
-from anthropic import AsyncAnthropic
+import orjson
+from anthropic import AsyncAnthropic, RateLimitError
+from cachetools import TTLCache
 
+from adaptive_limiter import AdaptiveLimiter, LimiterOpenError
 from config import settings
+from memoize import join_inflight
+
+
+def _json_text(value: Any) -> str:
+    """Compact JSON for prompt interpolation."""
+    return orjson.dumps(value).decode()
+
+
+_SPECIALIST_PROMPT_TEMPLATE = """You are {agent_name}.
+You are proposing clarifying questions only (not final advice).
+Return ONLY valid JSON object with keys:
+- primary_question: string
+- other_suggestions: array of strings
+- reasoning: short string (1-2 sentences, no chain-of-thought)
+
+Rules:
+- Do not answer the user.
+- Do not repeat already asked questions.
+- Keep questions specific and actionable.
+- Maximum 1 primary + up to 3 others.
+
+Focus guidance:
+{focus}
+"""
+
+# Specialist prompts are static, so they are formatted once at import.
+FINANCE_PROMPT = _SPECIALIST_PROMPT_TEMPLATE.format(
+    agent_name="FinanceBot",
+    focus="Budget limits, affordability, spending constraints, debt/cashflow trade-offs.",
+)
+LEARNING_PROMPT = _SPECIALIST_PROMPT_TEMPLATE.format(
+    agent_name="LearnBot",
+    focus="Knowledge gaps, decision criteria, timeline, user preferences and confidence.",
+)
+RISK_PROMPT = _SPECIALIST_PROMPT_TEMPLATE.format(
+    agent_name="RiskBot",
+    focus="Downside risk, uncertainty, safety margin, hidden costs, and worst-case resilience.",
+)
+
+JUDGE_PANEL_INSTRUCTIONS = """### ROLE
+You are the Lead Orchestrator and Chief Judge for specialist agents.
+Your goal is to pick ONE best next clarifying question.
+
+### INPUT
+- Original user query
+- Already asked Q/A
+- Candidate questions from FinanceBot, LearnBot, and RiskBot
+
+### OUTPUT
+Return ONLY a JSON object with fields:
+- chosen_question: string
+- chosen_from_agent: one of FinanceBot|LearnBot|RiskBot
+- judge_reasoning: short string (1-2 sentences, no chain-of-thought)
+- other_suggested_questions: array of strings
+
+### CONSTRAINTS
+- Do NOT answer the user.
+- Do NOT repeat asked questions.
+- Keep to short practical wording.
+"""
+
+
+FINANCE_INSTRUCTIONS = """You are FinanceBot, a financial advisor specializing in personal finance.
+Analyze the user's query from a financial perspective:
+- Assess affordability and budget implications
+- Consider ROI, financing options, and payment plans
+- Provide practical money-saving tips
+- Be concise and actionable (max 150 words)."""
+
+LEARNING_INSTRUCTIONS = """You are LearnBot, an educational resource curator.
+Analyze the user's query from a learning perspective:
+- Recommend relevant courses, tutorials, or books
+- Suggest skills they might need to develop
+- Point to free and paid learning resources
+- Be concise and actionable (max 150 words)."""
+
+JUDGE_SYNTHESIS_INSTRUCTIONS = """You are JudgeBot, a synthesis expert.
+You receive analyses from 2 specialist agents (Finance, Learning) and must:
+1. Synthesize their insights into ONE coherent recommendation
+2. Prioritize based on the user's stated intent
+3. Highlight the most actionable next steps
+4. Be helpful, clear, and concise (max 250 words)
+5. If an agent's response is unavailable, work with what you have
+
+Format your response as a helpful, conversational message without mentioning the other agents by name."""
+
+# Specialists are asked for at most 150 words (~200 tokens). A tighter cap
+# bounds how long a runaway answer can delay the judge, whose first token
+# waits on both specialists.
+SPECIALIST_MAX_TOKENS = 300
+
+INTENT_CONTEXT = {
+    "afford": "The user's primary concern is AFFORDABILITY and financial feasibility.",
+    "learn": "The user's primary concern is LEARNING and skill development.",
+}
 
 
 class AgentOrchestrator:
@@ -19,18 +120,71 @@ class AgentOrchestrator:
 
     def __init__(self):
         self.client: Optional[AsyncAnthropic] = None
-        self._initialized = False
-
-    def _ensure_initialized(self):
-        """Lazily initialize the Anthropic client."""
-        if not self._initialized:
-            if not settings.ANTHROPIC_API_KEY:
-                raise ValueError("Anthropic API key not configured")
-            self.client = AsyncAnthropic(
-                api_key=settings.ANTHROPIC_API_KEY,
-                base_url=settings.ANTHROPIC_API_BASE,
+        self._limiter: Optional[AdaptiveLimiter] = None
+        # Single-flight + short-lived results for identical agent prompts, so a
+        # preview followed by a stream (or parallel tabs) reuse one Claude call.
+        self._agent_inflight: dict[bytes, asyncio.Future[str]] = {}
+        self._agent_cache: Optional[TTLCache[bytes, str]] = None
+        if settings.AI_AGENT_CACHE_SIZE > 0 and settings.AI_AGENT_CACHE_TTL > 0:
+            self._agent_cache = TTLCache(
+                maxsize=settings.AI_AGENT_CACHE_SIZE, ttl=settings.AI_AGENT_CACHE_TTL
             )
-            self._initialized = True
+
+    def initialize(self) -> None:
+        """Create the Anthropic client; called once from the app lifespan.
+
+        Without an API key the client stays unset and every agent call
+        fails with "Anthropic API key not configured".
+        """
+        if self.client is not None or not settings.ANTHROPIC_API_KEY:
+            return
+        self.client = AsyncAnthropic(
+            api_key=settings.ANTHROPIC_API_KEY,
+            base_url=settings.ANTHROPIC_API_BASE,
+        )
+        # Shared by every request's fan-out so concurrent users cannot
+        # push the worker past Anthropic's concurrency limits.
+        if settings.ANTHROPIC_MAX_CONCURRENCY > 0:
+            self._limiter = AdaptiveLimiter(settings.ANTHROPIC_MAX_CONCURRENCY)
+
+    async def aclose(self) -> None:
+        """Drain and close the client's connection pool on shutdown."""
+        client, self.client = self.client, None
+        if client is not None:
+            await client.close()
+
+    def _require_client(self) -> AsyncAnthropic:
+        client = self.client
+        if client is None:
+            raise ValueError("Anthropic API key not configured")
+        return client
+
+    def check_claude_available(self) -> None:
+        """Raise LimiterOpenError while Claude calls are paused after a 429."""
+        if self._limiter is not None:
+            self._limiter.check_open()
+
+    @contextlib.asynccontextmanager
+    async def _claude_slot(self) -> AsyncIterator[float]:
+        """Hold a limiter slot and yield the monotonic time it was acquired.
+
+        A 429 shrinks the limit, opens the breaker and is re-raised as
+        LimiterOpenError carrying the pause, so it reaches the client as a
+        429 instead of an agent failure.
+        """
+        if self._limiter is None:
+            yield time.monotonic()
+            return
+        async with self._limiter.slot():
+            try:
+                yield time.monotonic()
+            except RateLimitError as exc:
+                retry_after = self._limiter.record_rate_limited(exc.response.headers)
+                raise LimiterOpenError(retry_after) from exc
+
+    def _record_capacity(self, headers: Mapping[str, str], started: float) -> None:
+        if self._limiter is not None:
+            self._limiter.record_success(headers, time.monotonic() - started)
 
     def _build_messages(self, instructions: str, query: str) -> list:
         return [
@@ -55,33 +209,66 @@ class AgentOrchestrator:
         }
 
     async def _call_claude(self, messages: list, temperature: float = 0.7, max_tokens: int = 500) -> str:
-        self._ensure_initialized()
-        assert self.client is not None
-        message = await self.client.messages.create(
+        client = self._require_client()
+        async with self._claude_slot() as started, client.messages.with_streaming_response.create(
             **self._payload(messages, temperature, max_tokens)
-        )
+        ) as response:
+            self._record_capacity(response.headers, started)
+            message = await response.parse()
         return self._extract_text(message)
 
     async def _stream_claude(
         self, messages: list, temperature: float = 0.7, max_tokens: int = 500
     ) -> AsyncGenerator[str, None]:
-        self._ensure_initialized()
-        assert self.client is not None
-        async with self.client.messages.stream(
+        client = self._require_client()
+        async with self._claude_slot() as started, client.messages.stream(
             **self._payload(messages, temperature, max_tokens)
         ) as stream:
+            self._record_capacity(stream.response.headers, started)
             async for text in stream.text_stream:
                 if text:
                     yield text
 
-    async def _run_agent(self, name: str, instructions: str, query: str) -> str:
+    async def _run_agent(
+        self, name: str, instructions: str, query: str, max_tokens: int = 500
+    ) -> str:
         """Run a single agent with the given instructions and query."""
         try:
-            messages = self._build_messages(instructions, query)
-            return await self._call_claude(messages, temperature=0.7, max_tokens=500)
+            return await self._shared_agent_call(name, instructions, query, max_tokens)
+        except LimiterOpenError:
+            # Rate limiting is the client's to back off from, not an agent outage.
+            raise
         except Exception as e:
             return f"[{name} unavailable: {str(e)}]"
 
+    async def _shared_agent_call(
+        self, name: str, instructions: str, query: str, max_tokens: int
+    ) -> str:
+        """Answer from cache or join an identical in-flight call before starting one."""
+        if self._agent_cache is None:
+            messages = self._build_messages(instructions, query)
+            return await self._call_claude(messages, temperature=0.7, max_tokens=max_tokens)
+
+        key = hashlib.blake2b(
+            "\0".join((name, instructions, query, str(max_tokens))).encode(), digest_size=16
+        ).digest()
+        cached = self._agent_cache.get(key)
+        if cached is not None:
+            return cached
+
+        return await join_inflight(
+            self._agent_inflight,
+            key,
+            lambda: self._call_claude(
+                self._build_messages(instructions, query), temperature=0.7, max_tokens=max_tokens
+            ),
+            functools.partial(self._cache_agent_result, key),
+        )
+
+    def _cache_agent_result(self, key: bytes, result: str) -> None:
+        if result and self._agent_cache is not None:
+            self._agent_cache[key] = result
+
     @staticmethod
     def _parse_question_list(raw: str) -> list[str]:
         """Parse a JSON array of question strings with graceful fallback."""
@@ -95,7 +282,7 @@ class AgentOrchestrator:
             text = text[start : end + 1]
 
         try:
-            parsed = json.loads(text)
+            parsed = orjson.loads(text)
             if isinstance(parsed, list):
                 cleaned = []
                 for item in parsed:
@@ -104,11 +291,15 @@ class AgentOrchestrator:
                         if normalized:
                             cleaned.append(normalized)
                 return cleaned
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             pass
 
+        # Only lines containing "?" can yield a question; skip the strip
+        # chain for the prose lines that make up most model output.
         fallback = []
         for line in raw.splitlines():
+            if "?" not in line:
+                continue
             candidate = line.strip().lstrip("-*").strip()
             if candidate.endswith("?") and len(candidate) > 4:
                 fallback.append(candidate)
@@ -127,10 +318,10 @@ class AgentOrchestrator:
             text = text[start : end + 1]
 
         try:
-            parsed = json.loads(text)
+            parsed = orjson.loads(text)
             if isinstance(parsed, dict):
                 return parsed
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return {}
         return {}
 
@@ -141,8 +332,10 @@ class AgentOrchestrator:
         seen: set[str] = set()
         for item in candidates:
             text = item.strip()
+            if not text:
+                continue
             norm = text.lower()
-            if not text or norm in seen or norm in asked_norm:
+            if norm in seen or norm in asked_norm:
                 continue
             seen.add(norm)
             deduped.append(text)
@@ -165,12 +358,15 @@ class AgentOrchestrator:
         other_any = parsed.get("other_suggestions")
         other: list[Any] = other_any if isinstance(other_any, list) else []
 
-        fallback_list = self._parse_question_list(raw)
         candidates: list[str] = []
         if primary:
             candidates.append(primary)
         candidates.extend([item for item in other if isinstance(item, str)])
-        candidates.extend(fallback_list)
+        # The list parser would re-parse the same text (usually just finding
+        # other_suggestions again), so only fall back to it when the object
+        # yielded nothing.
+        if not candidates:
+            candidates = self._parse_question_list(raw)
 
         deduped = self._dedupe_questions(candidates, asked_norm, limit=6)
         primary_question = deduped[0] if deduped else ""
@@ -202,53 +398,26 @@ class AgentOrchestrator:
             answer = answers[idx] if idx < len(answers) else ""
             qa_pairs.append({"question": question, "answer": answer})
 
+        # Each list is encoded once and shared by the specialist and judge prompts.
+        asked_json = _json_text(asked_questions)
+        qa_json = _json_text(qa_pairs)
         context_block = f"""
 ORIGINAL USER QUERY:
 {user_original_query}
 
 ALREADY ASKED QUESTIONS (do not repeat):
-{json.dumps(asked_questions, ensure_ascii=True)}
+{asked_json}
 
 USER ANSWERS SO FAR:
-{json.dumps(answers, ensure_ascii=True)}
+{_json_text(answers)}
 
 Q/A CONTEXT:
-{json.dumps(qa_pairs, ensure_ascii=True)}
+{qa_json}
 """
 
-        specialist_prompt_template = """You are {agent_name}.
-You are proposing clarifying questions only (not final advice).
-Return ONLY valid JSON object with keys:
-- primary_question: string
-- other_suggestions: array of strings
-- reasoning: short string (1-2 sentences, no chain-of-thought)
-
-Rules:
-- Do not answer the user.
-- Do not repeat already asked questions.
-- Keep questions specific and actionable.
-- Maximum 1 primary + up to 3 others.
-
-Focus guidance:
-{focus}
-"""
-
-        finance_prompt = specialist_prompt_template.format(
-            agent_name="FinanceBot",
-            focus="Budget limits, affordability, spending constraints, debt/cashflow trade-offs.",
-        )
-        learning_prompt = specialist_prompt_template.format(
-            agent_name="LearnBot",
-            focus="Knowledge gaps, decision criteria, timeline, user preferences and confidence.",
-        )
-        risk_prompt = specialist_prompt_template.format(
-            agent_name="RiskBot",
-            focus="Downside risk, uncertainty, safety margin, hidden costs, and worst-case resilience.",
-        )
-
-        finance_task = self._run_agent("FinanceBot", finance_prompt, context_block)
-        learning_task = self._run_agent("LearnBot", learning_prompt, context_block)
-        risk_task = self._run_agent("RiskBot", risk_prompt, context_block)
+        finance_task = self._run_agent("FinanceBot", FINANCE_PROMPT, context_block)
+        learning_task = self._run_agent("LearnBot", LEARNING_PROMPT, context_block)
+        risk_task = self._run_agent("RiskBot", RISK_PROMPT, context_block)
         finance_raw, learning_raw, risk_raw = await asyncio.gather(
             finance_task,
             learning_task,
@@ -271,45 +440,23 @@ Focus guidance:
             if isinstance(panel.get("reasoning"), str) and panel["reasoning"]
         }
 
-        judge_instructions = """### ROLE
-You are the Lead Orchestrator and Chief Judge for specialist agents.
-Your goal is to pick ONE best next clarifying question.
-
-### INPUT
-- Original user query
-- Already asked Q/A
-- Candidate questions from FinanceBot, LearnBot, and RiskBot
-
-### OUTPUT
-Return ONLY a JSON object with fields:
-- chosen_question: string
-- chosen_from_agent: one of FinanceBot|LearnBot|RiskBot
-- judge_reasoning: short string (1-2 sentences, no chain-of-thought)
-- other_suggested_questions: array of strings
-
-### CONSTRAINTS
-- Do NOT answer the user.
-- Do NOT repeat asked questions.
-- Keep to short practical wording.
-"""
-
         judge_query = f"""
 USER ORIGINAL QUERY:
 "{user_original_query}"
 
 ALREADY ASKED:
-{json.dumps(asked_questions, ensure_ascii=True)}
+{asked_json}
 
 Q/A CONTEXT:
-{json.dumps(qa_pairs, ensure_ascii=True)}
+{qa_json}
 
 AGENT PANELS:
-{json.dumps(agent_panels, ensure_ascii=True)}
+{_json_text(agent_panels)}
 
 Maximum questions to surface: {max_questions}
 """
 
-        judge_raw = await self._run_agent("JudgeBot", judge_instructions, judge_query)
+        judge_raw = await self._run_agent("JudgeBot", JUDGE_PANEL_INSTRUCTIONS, judge_query)
         judge_obj = self._parse_json_object(judge_raw)
 
         flattened_candidates: list[str] = []
@@ -407,7 +554,7 @@ Maximum questions to surface: {max_questions}
             "If the buffer appears weak, be conservative and clearly state the risk."
         )
         if guardrail_notes:
-            guardrail_context += f"\nGuardrail answer(s): {json.dumps(guardrail_notes, ensure_ascii=True)}"
+            guardrail_context += f"\nGuardrail answer(s): {_json_text(guardrail_notes)}"
 
         return (
             f"Original user query:\n{original_query}\n\n"
@@ -429,59 +576,28 @@ Maximum questions to surface: {max_questions}
         async for text in self.stream_judge_response(intent, enriched_query):
             yield text
 
-    async def process_query(self, intent: str, query: str) -> dict:
-        """Process a user query through specialist agents and synthesize with Judge.
-
-        Args:
-            intent: One of 'afford', 'learn'
-            query: The user's question
-
-        Returns:
-            dict with 'response' (JudgeBot synthesis) and 'intent'
-        """
-        finance_instructions = """You are FinanceBot, a financial advisor specializing in personal finance.
-Analyze the user's query from a financial perspective:
-- Assess affordability and budget implications
-- Consider ROI, financing options, and payment plans
-- Provide practical money-saving tips
-- Be concise and actionable (max 150 words)."""
-
-        learning_instructions = """You are LearnBot, an educational resource curator.
-Analyze the user's query from a learning perspective:
-- Recommend relevant courses, tutorials, or books
-- Suggest skills they might need to develop
-- Point to free and paid learning resources
-- Be concise and actionable (max 150 words)."""
-
-        # Run both specialists in parallel
-        finance_task = self._run_agent("FinanceBot", finance_instructions, query)
-        learning_task = self._run_agent("LearnBot", learning_instructions, query)
+    async def _judge_synthesis_query(self, intent: str, query: str) -> str:
+        """Run both specialists in parallel and build the Judge synthesis query."""
+        finance_task = self._run_agent(
+            "FinanceBot", FINANCE_INSTRUCTIONS, query, max_tokens=SPECIALIST_MAX_TOKENS
+        )
+        learning_task = self._run_agent(
+            "LearnBot", LEARNING_INSTRUCTIONS, query, max_tokens=SPECIALIST_MAX_TOKENS
+        )
 
         responses = await asyncio.gather(
             finance_task,
             learning_task,
             return_exceptions=True
         )
+        for response in responses:
+            if isinstance(response, LimiterOpenError):
+                raise response
 
         finance_response = responses[0] if not isinstance(responses[0], Exception) else "[FinanceBot unavailable]"
         learning_response = responses[1] if not isinstance(responses[1], Exception) else "[LearnBot unavailable]"
 
-        judge_instructions = """You are JudgeBot, a synthesis expert.
-You receive analyses from 2 specialist agents (Finance, Learning) and must:
-1. Synthesize their insights into ONE coherent recommendation
-2. Prioritize based on the user's stated intent
-3. Highlight the most actionable next steps
-4. Be helpful, clear, and concise (max 250 words)
-5. If an agent's response is unavailable, work with what you have
-
-Format your response as a helpful, conversational message without mentioning the other agents by name."""
-
-        intent_context = {
-            "afford": "The user's primary concern is AFFORDABILITY and financial feasibility.",
-            "learn": "The user's primary concern is LEARNING and skill development.",
-        }
-
-        judge_query = f"""User's intent: {intent_context.get(intent, "General assistance")}
+        return f"""User's intent: {INTENT_CONTEXT.get(intent, "General assistance")}
 User's question: {query}
 
 Expert Analyses:
@@ -495,7 +611,18 @@ LEARNING PERSPECTIVE:
 
 Synthesize these into one actionable recommendation for the user."""
 
-        synthesis = await self._run_agent("JudgeBot", judge_instructions, judge_query)
+    async def process_query(self, intent: str, query: str) -> dict:
+        """Process a user query through specialist agents and synthesize with Judge.
+
+        Args:
+            intent: One of 'afford', 'learn'
+            query: The user's question
+
+        Returns:
+            dict with 'response' (JudgeBot synthesis) and 'intent'
+        """
+        judge_query = await self._judge_synthesis_query(intent, query)
+        synthesis = await self._run_agent("JudgeBot", JUDGE_SYNTHESIS_INSTRUCTIONS, judge_query)
 
         return {
             "intent": intent,
@@ -506,62 +633,8 @@ Synthesize these into one actionable recommendation for the user."""
 
     async def stream_judge_response(self, intent: str, query: str) -> AsyncGenerator[str, None]:
         """Stream the Judge response after collecting specialist analyses."""
-        finance_instructions = """You are FinanceBot, a financial advisor specializing in personal finance.
-Analyze the user's query from a financial perspective:
-- Assess affordability and budget implications
-- Consider ROI, financing options, and payment plans
-- Provide practical money-saving tips
-- Be concise and actionable (max 150 words)."""
-
-        learning_instructions = """You are LearnBot, an educational resource curator.
-Analyze the user's query from a learning perspective:
-- Recommend relevant courses, tutorials, or books
-- Suggest skills they might need to develop
-- Point to free and paid learning resources
-- Be concise and actionable (max 150 words)."""
-
-        finance_task = self._run_agent("FinanceBot", finance_instructions, query)
-        learning_task = self._run_agent("LearnBot", learning_instructions, query)
-
-        responses = await asyncio.gather(
-            finance_task,
-            learning_task,
-            return_exceptions=True
-        )
-
-        finance_response = responses[0] if not isinstance(responses[0], Exception) else "[FinanceBot unavailable]"
-        learning_response = responses[1] if not isinstance(responses[1], Exception) else "[LearnBot unavailable]"
-
-        judge_instructions = """You are JudgeBot, a synthesis expert.
-You receive analyses from 2 specialist agents (Finance, Learning) and must:
-1. Synthesize their insights into ONE coherent recommendation
-2. Prioritize based on the user's stated intent
-3. Highlight the most actionable next steps
-4. Be helpful, clear, and concise (max 250 words)
-5. If an agent's response is unavailable, work with what you have
-
-Format your response as a helpful, conversational message without mentioning the other agents by name."""
-
-        intent_context = {
-            "afford": "The user's primary concern is AFFORDABILITY and financial feasibility.",
-            "learn": "The user's primary concern is LEARNING and skill development.",
-        }
-
-        judge_query = f"""User's intent: {intent_context.get(intent, "General assistance")}
-User's question: {query}
-
-Expert Analyses:
----
-FINANCIAL PERSPECTIVE:
-{finance_response}
-
-LEARNING PERSPECTIVE:
-{learning_response}
----
-
-Synthesize these into one actionable recommendation for the user."""
-
-        messages = self._build_messages(judge_instructions, judge_query)
+        judge_query = await self._judge_synthesis_query(intent, query)
+        messages = self._build_messages(JUDGE_SYNTHESIS_INSTRUCTIONS, judge_query)
         async for text in self._stream_claude(messages, temperature=0.7, max_tokens=500):
             yield text
 
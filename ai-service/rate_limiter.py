@@ -1,11 +1,13 @@
 """Redis-backed rate limiter for ai-service.
 
 Extracted from backend/src/services/rate_limiter.py.
-Uses a sliding-window algorithm with Redis sorted sets.
+Uses a sliding-window algorithm with Redis sorted sets for per-user limits
+and a shared token bucket for client-side Anthropic budgets.
 Fails open if Redis is unavailable to avoid hard outages.
 """
 
 import time
+import uuid
 from typing import Optional, Tuple
 
 import redis.asyncio as redis
@@ -15,6 +17,70 @@ from config import settings
 
 # Singleton Redis client (lazy)
 _redis_client: Optional[redis.Redis] = None
+_consume_script = None
+_used_script = None
+_take_script = None
+
+# Prune, count, admit-or-deny and record in one server-side step so concurrent
+# requests can't both pass the limit check. Returns {allowed, remaining, retry_after}.
+_CONSUME_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+local used = redis.call('ZCARD', key)
+if used >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local oldest_ts = now
+    if oldest[2] then
+        oldest_ts = tonumber(oldest[2])
+    end
+    local retry_after = window - (now - oldest_ts)
+    if retry_after < 1 then
+        retry_after = 1
+    end
+    return {0, 0, retry_after}
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('EXPIRE', key, window)
+return {1, limit - used - 1, 0}
+"""
+
+# Prune and count in one round trip for read-only status checks.
+_USED_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, tonumber(ARGV[1]))
+return redis.call('ZCARD', KEYS[1])
+"""
+
+
+# Refill both buckets for the time since the last call and take one request
+# plus `cost` tokens if both cover it, in one server-side step so every worker
+# draws on the same budget. Returns the seconds to wait (0 when taken) as a
+# string, since Redis truncates Lua numbers to integers.
+_TAKE_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', key, 'requests', 'tokens', 'updated')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+requests = math.min(rpm, requests + elapsed * rpm / 60)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60)
+local wait = 0
+if requests >= 1 and tokens >= cost then
+    requests = requests - 1
+    tokens = tokens - cost
+else
+    wait = math.max((1 - requests) * 60 / rpm, (cost - tokens) * 60 / tpm)
+end
+redis.call('HSET', key, 'requests', tostring(requests), 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', key, 60)
+return tostring(wait)
+"""
 
 
 def _get_redis() -> redis.Redis:
@@ -29,55 +95,104 @@ def _get_redis() -> redis.Redis:
     return _redis_client
 
 
-async def check_rate_limit(user_id: str, max_requests: int, window_seconds: int) -> Tuple[bool, int]:
+def _get_consume_script():
+    """Return the registered check-and-consume script (EVALSHA with EVAL fallback)."""
+    global _consume_script
+    if _consume_script is None:
+        _consume_script = _get_redis().register_script(_CONSUME_LUA)
+    return _consume_script
+
+
+def _get_used_script():
+    """Return the registered prune-and-count script."""
+    global _used_script
+    if _used_script is None:
+        _used_script = _get_redis().register_script(_USED_LUA)
+    return _used_script
+
+
+def _get_take_script():
+    """Return the registered refill-and-take token bucket script."""
+    global _take_script
+    if _take_script is None:
+        _take_script = _get_redis().register_script(_TAKE_LUA)
+    return _take_script
+
+
+async def check_and_consume(
+    user_id: str, max_requests: int, window_seconds: int
+) -> Tuple[bool, int, int]:
     """Sliding-window rate limit using a Redis sorted set per user.
 
-    Returns (allowed, retry_after_seconds).
+    Atomically checks the window and, if allowed, records this request.
+    Returns (allowed, remaining_requests, retry_after_seconds).
     Fail-open if Redis is unavailable.
     """
-    redis_client = _get_redis()
     now = int(time.time())
-    window_start = now - window_seconds
-    key = f"rate:{user_id}"
-
+    # Unique member per request; same-second requests must not collapse.
+    member = f"{now}:{uuid.uuid4().hex}"
     try:
-        await redis_client.zremrangebyscore(key, 0, window_start)
-        current = await redis_client.zcard(key)
-        if current >= max_requests:
-            oldest = await redis_client.zrange(key, 0, 0, withscores=True)
-            oldest_ts = int(oldest[0][1]) if oldest else now
-            retry_after = max(1, window_seconds - (now - oldest_ts))
-            return False, retry_after
-
-        await redis_client.zadd(key, {str(now): now})
-        await redis_client.expire(key, window_seconds)
-        return True, 0
+        allowed, remaining, retry_after = await _get_consume_script()(
+            keys=[f"rate:{user_id}"],
+            args=[now, window_seconds, max_requests, member],
+        )
+        return bool(allowed), int(remaining), int(retry_after)
     except Exception:
         # Fail-open
-        return True, 0
+        return True, max_requests, 0
+
+
+async def check_rate_limit(user_id: str, max_requests: int, window_seconds: int) -> Tuple[bool, int]:
+    """Returns (allowed, retry_after_seconds); see check_and_consume."""
+    allowed, _remaining, retry_after = await check_and_consume(user_id, max_requests, window_seconds)
+    return allowed, retry_after
 
 
 async def remaining_requests(user_id: str, max_requests: int, window_seconds: int) -> int:
     """Return remaining requests in the current window (best effort)."""
-    redis_client = _get_redis()
-    now = int(time.time())
-    window_start = now - window_seconds
+    window_start = int(time.time()) - window_seconds
     try:
-        await redis_client.zremrangebyscore(f"rate:{user_id}", 0, window_start)
-        used = await redis_client.zcard(f"rate:{user_id}")
-        return max(0, max_requests - used)
+        used = await _get_used_script()(keys=[f"rate:{user_id}"], args=[window_start])
+        return max(0, max_requests - int(used))
     except Exception:
         return max_requests
 
 
-async def enforce_rate_limit(user_id: str, max_requests: int, window_seconds: int):
-    """Raise HTTP 429 if user exceeds rate limit."""
-    allowed, retry_after = await check_rate_limit(user_id, max_requests, window_seconds)
-    if not allowed:
-        raise HTTPException(
-            status_code=429,
-            detail={
-                "error": "rate_limit",
-                "retry_after_seconds": retry_after,
-            },
+async def take_tokens(
+    bucket: str, requests_per_minute: int, tokens_per_minute: int, tokens: int
+) -> float:
+    """Take one request and ``tokens`` from a token bucket shared across workers.
+
+    Both budgets refill continuously over a minute. Returns 0 when taken,
+    otherwise the seconds until the scarcer budget covers the call; nothing
+    is taken then, so the caller sleeps and asks again.
+    Fail-open if Redis is unavailable.
+    """
+    try:
+        wait = await _get_take_script()(
+            keys=[f"bucket:{bucket}"],
+            args=[time.time(), requests_per_minute, tokens_per_minute, tokens],
         )
+        return float(wait)
+    except Exception:
+        return 0.0
+
+
+def rate_limit_exception(retry_after: int) -> HTTPException:
+    """The 429 every AI endpoint sends when a caller must back off."""
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "rate_limit",
+            "retry_after_seconds": retry_after,
+        },
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+async def enforce_rate_limit(user_id: str, max_requests: int, window_seconds: int) -> int:
+    """Raise HTTP 429 if user exceeds rate limit; otherwise return remaining requests."""
+    allowed, remaining, retry_after = await check_and_consume(user_id, max_requests, window_seconds)
+    if not allowed:
+        raise rate_limit_exception(retry_after)
+    return remaining
@@ -0,0 +1,79 @@
+"""AIMD limiter adjustments and how an open breaker reaches the client."""
+
+import time
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import main
+from adaptive_limiter import AdaptiveLimiter, LimiterOpenError
+from config import settings
+from orchestrator import AgentOrchestrator, orchestrator
+
+HEALTHY = {"anthropic-ratelimit-requests-remaining": "900", "anthropic-ratelimit-requests-limit": "1000"}
+LOW = {"anthropic-ratelimit-requests-remaining": "50", "anthropic-ratelimit-requests-limit": "1000"}
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_low_remaining_capacity_halves_the_limit():
+    limiter = AdaptiveLimiter(8)
+    limiter.record_success(LOW, 0.5)
+    assert limiter.limit == 4
+
+
+def test_grows_on_healthy_latency_and_holds_on_slow_calls():
+    limiter = AdaptiveLimiter(8)
+    limiter.record_success(LOW, None)
+    limiter.record_success(HEALTHY, 0.5)
+    grown = limiter._limit
+    assert grown > 4
+
+    limiter.record_success(HEALTHY, 5.0)
+    assert limiter._limit == grown
+
+    limiter.record_success(HEALTHY, 0.6)
+    assert limiter._limit > grown
+
+
+def test_rate_limited_opens_the_breaker_for_retry_after():
+    limiter = AdaptiveLimiter(8)
+    assert limiter.record_rate_limited({"retry-after": "30"}) == 30
+    assert limiter.limit == 4
+    with pytest.raises(LimiterOpenError) as exc_info:
+        limiter.check_open()
+    assert 29 < exc_info.value.retry_after <= 30
+
+
+@pytest.mark.anyio
+async def test_open_breaker_propagates_out_of_the_synthesis_path(monkeypatch):
+    async def rate_limited(self, messages, temperature=0.7, max_tokens=500):
+        raise LimiterOpenError(12)
+
+    monkeypatch.setattr(AgentOrchestrator, "_call_claude", rate_limited)
+    with pytest.raises(LimiterOpenError):
+        await AgentOrchestrator().process_query("afford", "Can I afford a new camera?")
+
+
+def test_query_endpoint_answers_429_while_the_breaker_is_open(monkeypatch):
+    limiter = AdaptiveLimiter(4)
+    limiter.record_rate_limited({"retry-after": "30"})
+    monkeypatch.setattr(orchestrator, "_limiter", limiter)
+    monkeypatch.setattr(auth, "_AI_OR_ADMIN_ALLOWLIST", frozenset({"alice"}))
+    token = jwt.encode(
+        {"sub": "alice", "exp": int(time.time()) + 3600},
+        settings.SECRET_KEY,
+        algorithm=settings.ALGORITHM,
+    )
+    body = {"intent": "afford", "query": "Can I afford a new camera?"}
+    client = TestClient(main.app, cookies={"access_token": token})
+    for path in ("/ai/query", "/ai/query/stream"):
+        response = client.post(path, json=body)
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "30"
+        assert response.json() == {"detail": {"error": "rate_limit", "retry_after_seconds": 30}}
@@ -0,0 +1,97 @@
+"""_decode_token must accept and reject exactly what jwt.decode does."""
+
+import base64
+import json
+import time
+
+import jwt
+import pytest
+
+import auth
+from config import settings
+
+NOW = int(time.time())
+HOUR = 3600
+
+
+def _encode(payload, algorithm=settings.ALGORITHM, headers=None, key=settings.SECRET_KEY):
+    return jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+
+def _tamper_signature(token):
+    signing_input, _, signature = token.rpartition(".")
+    flipped = "A" if signature[0] != "A" else "B"
+    return f"{signing_input}.{flipped}{signature[1:]}"
+
+
+def _swap_payload(token, payload):
+    header, _, signature = token.split(".")
+    body = base64.urlsafe_b64encode(json.dumps(payload).encode()).rstrip(b"=")
+    return f"{header}.{body.decode()}.{signature}"
+
+
+VALID = {"sub": "alice", "exp": NOW + HOUR}
+
+TOKENS = {
+    "valid": _encode(VALID),
+    "valid_with_iat_nbf": _encode({**VALID, "iat": NOW - 10, "nbf": NOW - 10}),
+    "valid_without_typ": _encode(VALID, headers={"typ": None}),
+    "expired": _encode({"sub": "alice", "exp": NOW - HOUR}),
+    "nbf_in_future": _encode({**VALID, "nbf": NOW + HOUR}),
+    "iat_in_future": _encode({**VALID, "iat": NOW + HOUR}),
+    "iat_not_integer": _encode({**VALID, "iat": "yesterday"}),
+    "iat_float": _encode({**VALID, "iat": NOW - 10.5}),
+    "aud_present": _encode({**VALID, "aud": "other"}),
+    "aud_list": _encode({**VALID, "aud": ["other"]}),
+    "aud_empty": _encode({**VALID, "aud": ""}),
+    "iss_present": _encode({**VALID, "iss": "someone"}),
+    "jti_not_string": _encode({**VALID, "jti": 7}),
+    "kid_header": _encode(VALID, headers={"kid": "k1"}),
+    "wrong_alg": _encode(VALID, algorithm="HS512"),
+    "alg_none": _encode(VALID, algorithm="none", key=None),
+    "wrong_key": _encode(VALID, key="not-the-secret-key-not-the-secret"),
+    "tampered_signature": _tamper_signature(_encode(VALID)),
+    "tampered_payload": _swap_payload(_encode(VALID), {"sub": "admin", "exp": NOW + HOUR}),
+    "missing_sub": _encode({"exp": NOW + HOUR}),
+    "missing_exp": _encode({"sub": "alice"}),
+    "sub_not_string": _encode({"sub": 42, "exp": NOW + HOUR}),
+    "exp_float": _encode({"sub": "alice", "exp": NOW + HOUR + 0.5}),
+    "exp_string": _encode({"sub": "alice", "exp": str(NOW + HOUR)}),
+    "exp_bool": _encode({"sub": "alice", "exp": True}),
+    "extra_claim": _encode({**VALID, "role": "admin"}),
+    "not_a_jwt": "not-a-jwt",
+    "two_segments": "abc.def",
+    "four_segments": _encode(VALID) + ".extra",
+    "bad_base64": "###.###.###",
+}
+
+
+def _outcome(decode, token):
+    try:
+        return decode(token)
+    except jwt.PyJWTError as exc:
+        return type(exc)
+
+
+def _reference_decode(token):
+    return jwt.decode(
+        token,
+        settings.SECRET_KEY,
+        algorithms=[settings.ALGORITHM],
+        options={"require": ["sub", "exp"]},
+    )
+
+
+@pytest.mark.parametrize("name", sorted(TOKENS))
+def test_decode_token_matches_pyjwt(name):
+    token = TOKENS[name]
+    assert _outcome(auth._decode_token, token) == _outcome(_reference_decode, token)
+
+
+def test_fast_path_still_rejects_aud():
+    with pytest.raises(jwt.InvalidAudienceError):
+        auth._decode_token(TOKENS["aud_present"])
+
+
+def test_fast_path_accepts_backend_token():
+    assert auth._decode_token(TOKENS["valid"]) == VALID
@@ -0,0 +1,92 @@
+"""async_lru_ttl: TTL caching plus sharing of concurrent identical calls."""
+
+import asyncio
+
+import pytest
+
+from memoize import async_lru_ttl
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _counting(result=lambda arg: {"value": arg}, delay=0.01):
+    calls = []
+
+    async def func(arg):
+        calls.append(arg)
+        await asyncio.sleep(delay)
+        return result(arg)
+
+    return func, calls
+
+
+@pytest.mark.anyio
+async def test_concurrent_identical_calls_share_one_run():
+    func, calls = _counting()
+    cached = async_lru_ttl(maxsize=8, ttl=60)(func)
+
+    results = await asyncio.gather(*(cached("q") for _ in range(5)))
+
+    assert calls == ["q"]
+    assert results == [{"value": "q"}] * 5
+    assert await cached("q") == {"value": "q"}
+    assert calls == ["q"]
+
+
+@pytest.mark.anyio
+async def test_distinct_arguments_run_separately():
+    func, calls = _counting()
+    cached = async_lru_ttl(maxsize=8, ttl=60)(func)
+
+    await asyncio.gather(cached("a"), cached("b"))
+
+    assert sorted(calls) == ["a", "b"]
+
+
+@pytest.mark.anyio
+async def test_rejected_results_are_shared_but_not_cached():
+    func, calls = _counting(result=lambda arg: {"ok": False})
+    cached = async_lru_ttl(maxsize=8, ttl=60, should_cache=lambda r: r["ok"])(func)
+
+    await asyncio.gather(cached("q"), cached("q"))
+    assert calls == ["q"]
+
+    await cached("q")
+    assert calls == ["q", "q"]
+
+
+@pytest.mark.anyio
+async def test_failures_reach_every_waiter_and_are_retried():
+    calls = []
+
+    async def failing(arg):
+        calls.append(arg)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    cached = async_lru_ttl(maxsize=8, ttl=60)(failing)
+
+    results = await asyncio.gather(cached("q"), cached("q"), return_exceptions=True)
+    assert [type(r) for r in results] == [RuntimeError, RuntimeError]
+    assert calls == ["q"]
+
+    with pytest.raises(RuntimeError):
+        await cached("q")
+    assert calls == ["q", "q"]
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_does_not_cancel_shared_run():
+    func, calls = _counting(delay=0.05)
+    cached = async_lru_ttl(maxsize=8, ttl=60)(func)
+
+    first = asyncio.ensure_future(cached("q"))
+    second = asyncio.ensure_future(cached("q"))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == {"value": "q"}
+    assert calls == ["q"]
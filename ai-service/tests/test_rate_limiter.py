@@ -0,0 +1,176 @@
+"""Sliding-window limits enforced by the check-and-consume Lua script."""
+
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import auth
+import main
+import rate_limiter
+from config import settings
+
+# The scripts run for real: needs fakeredis with its Lua extra (fakeredis[lua]).
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+WINDOW = 3600
+T0 = 1_700_000_000
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=T0)
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(rate_limiter, "_redis_client", client)
+    monkeypatch.setattr(rate_limiter, "_consume_script", None)
+    monkeypatch.setattr(rate_limiter, "_used_script", None)
+    monkeypatch.setattr(rate_limiter, "_take_script", None)
+    return client
+
+
+async def _consume(user="alice", limit=3):
+    return await rate_limiter.check_and_consume(user, limit, WINDOW)
+
+
+async def _remaining(user="alice", limit=3):
+    return await rate_limiter.remaining_requests(user, limit, WINDOW)
+
+
+@pytest.mark.anyio
+async def test_allows_up_to_limit_then_denies(clock, redis_client):
+    assert [await _consume() for _ in range(3)] == [(True, 2, 0), (True, 1, 0), (True, 0, 0)]
+    assert await _consume() == (False, 0, WINDOW)
+    assert await _remaining() == 0
+
+
+@pytest.mark.anyio
+async def test_denied_requests_are_not_recorded(clock, redis_client):
+    for _ in range(5):
+        await _consume(limit=2)
+    assert await redis_client.zcard("rate:alice") == 2
+
+
+@pytest.mark.anyio
+async def test_limits_are_per_user(clock, redis_client):
+    for _ in range(3):
+        await _consume(user="alice")
+    assert (await _consume(user="alice"))[0] is False
+    assert await _consume(user="bob") == (True, 2, 0)
+
+
+@pytest.mark.anyio
+async def test_retry_after_counts_down_to_oldest_entry_expiry(clock, redis_client):
+    await _consume(limit=2)
+    clock.value = T0 + 1000
+    await _consume(limit=2)
+    clock.value = T0 + 1500
+    assert await _consume(limit=2) == (False, 0, WINDOW - 1500)
+
+
+@pytest.mark.anyio
+async def test_window_expiry_frees_slots(clock, redis_client):
+    await _consume(limit=2)
+    clock.value = T0 + 1000
+    await _consume(limit=2)
+
+    clock.value = T0 + WINDOW - 1
+    assert (await _consume(limit=2))[0] is False
+    assert await _remaining(limit=2) == 0
+
+    # The T0 entry leaves the window exactly WINDOW seconds later.
+    clock.value = T0 + WINDOW
+    assert await _consume(limit=2) == (True, 0, 0)
+    assert await _remaining(limit=2) == 0
+
+    clock.value = T0 + WINDOW + 1000
+    assert await _remaining(limit=2) == 1
+
+
+@pytest.mark.anyio
+async def test_enforce_rate_limit_raises_429_with_retry_after(clock, redis_client):
+    assert await rate_limiter.enforce_rate_limit("alice", 1, WINDOW) == 0
+    with pytest.raises(HTTPException) as exc_info:
+        await rate_limiter.enforce_rate_limit("alice", 1, WINDOW)
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers == {"Retry-After": str(WINDOW)}
+    assert exc_info.value.detail == {"error": "rate_limit", "retry_after_seconds": WINDOW}
+
+
+@pytest.mark.anyio
+async def test_fails_open_when_redis_is_unreachable(clock, monkeypatch):
+    unreachable = rate_limiter.redis.from_url("redis://127.0.0.1:1/0")
+    monkeypatch.setattr(rate_limiter, "_redis_client", unreachable)
+    monkeypatch.setattr(rate_limiter, "_consume_script", None)
+    monkeypatch.setattr(rate_limiter, "_used_script", None)
+    assert await _consume(limit=3) == (True, 3, 0)
+    assert await _remaining(limit=3) == 3
+
+
+@pytest.mark.anyio
+async def test_token_bucket_is_shared_and_refills_over_a_minute(clock, redis_client):
+    # Two calls' worth of tokens: the third call waits on tokens, not requests.
+    assert await rate_limiter.take_tokens("gmail", 10, 200, 100) == 0
+    assert await rate_limiter.take_tokens("gmail", 10, 200, 100) == 0
+    assert await rate_limiter.take_tokens("gmail", 10, 200, 100) == pytest.approx(30)
+
+    # A denied take costs nothing, so half the wait covers half the tokens.
+    clock.value = T0 + 15
+    assert await rate_limiter.take_tokens("gmail", 10, 200, 100) == pytest.approx(15)
+    clock.value = T0 + 30
+    assert await rate_limiter.take_tokens("gmail", 10, 200, 100) == 0
+
+
+@pytest.mark.anyio
+async def test_token_bucket_waits_on_the_scarcer_budget(clock, redis_client):
+    assert await rate_limiter.take_tokens("gmail", 1, 10_000, 10) == 0
+    assert await rate_limiter.take_tokens("gmail", 1, 10_000, 10) == pytest.approx(60)
+
+
+@pytest.mark.anyio
+async def test_token_bucket_fails_open_when_redis_is_unreachable(clock, monkeypatch):
+    unreachable = rate_limiter.redis.from_url("redis://127.0.0.1:1/0")
+    monkeypatch.setattr(rate_limiter, "_redis_client", unreachable)
+    monkeypatch.setattr(rate_limiter, "_take_script", None)
+    assert await rate_limiter.take_tokens("gmail", 1, 10, 10) == 0
+
+
+def test_query_endpoint_reports_remaining_then_429(clock, redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "AI_RATE_LIMIT_PER_HOUR", 2)
+    monkeypatch.setattr(auth, "_AI_OR_ADMIN_ALLOWLIST", frozenset({"alice"}))
+
+    async def fake_clarify(intent, query, state, answers):
+        return {"intent": intent, "query": query, "question": "Budget?"}
+
+    monkeypatch.setattr(main, "_resolve_next_clarify", fake_clarify)
+    token = jwt.encode(
+        {"sub": "alice", "exp": int(time.time()) + WINDOW},
+        settings.SECRET_KEY,
+        algorithm=settings.ALGORITHM,
+    )
+    body = {"intent": "afford", "query": "Can I afford a new camera?"}
+    # One client session keeps every request on the same event loop.
+    with TestClient(main.app, cookies={"access_token": token}) as client:
+        first = client.post("/ai/query", json=body)
+        second = client.post("/ai/query", json=body)
+        third = client.post("/ai/query", json=body)
+
+    assert first.status_code == 200
+    assert first.headers["X-RateLimit-Remaining"] == "1"
+    assert second.headers["X-RateLimit-Remaining"] == "0"
+    assert third.status_code == 429
+    assert third.headers["Retry-After"] == str(WINDOW)
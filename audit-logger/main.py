@@ -1,9 +1,13 @@
 """Throwaway audit logger microservice for TD-5 testing."""
 import asyncio
 import logging
+import queue
 import sqlite3
-from datetime import datetime
-from fastapi import FastAPI, BackgroundTasks
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import FastAPI
 from pydantic import BaseModel
 
 app = FastAPI(title="Audit Logger (Throwaway)")
@@ -14,77 +18,166 @@ logger = logging.getLogger(__name__)
 # In-memory SQLite for throwaway testing
 DB_PATH = "/tmp/audit.db"
 
+# Rows per INSERT transaction; whatever is queued (up to this) commits together.
+BATCH_SIZE = 500
+# Long-lived read connections shared by /logs requests.
+READER_POOL_SIZE = 2
+
+_INSERT_SQL = """INSERT INTO audit_logs
+               (timestamp, username, endpoint, action, allowed)
+               VALUES (?, ?, ?, ?, ?)"""
+
 
 class AuditLog(BaseModel):
-    timestamp: str
+    timestamp: datetime
     username: str
     endpoint: str
     action: str
     allowed: bool
 
 
+def tune_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Per-connection PRAGMAs: audit rows are throwaway, so trade durability for speed."""
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+
 def init_db():
     """Initialize SQLite DB."""
     conn = sqlite3.connect(DB_PATH)
+    # Persistent on the file: WAL lets /logs read while the writer commits,
+    # and a commit needs no rollback-journal fsync.
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(audit_logs)")}
+    if columns and columns.get("timestamp") != "INTEGER":
+        # Throwaway data: rebuild tables left over from the TEXT-timestamp schema.
+        conn.execute("DROP TABLE audit_logs")
+    # timestamp is epoch milliseconds: fixed-size compares and a small index.
+    # No AUTOINCREMENT, so inserts skip the sqlite_sequence update.
     conn.execute("""
         CREATE TABLE IF NOT EXISTS audit_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
+            id INTEGER PRIMARY KEY,
+            timestamp INTEGER,
             username TEXT,
             endpoint TEXT,
             action TEXT,
             allowed BOOLEAN
         )
     """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS ix_audit_ts ON audit_logs(timestamp DESC)"
+    )
     conn.commit()
     conn.close()
 
 
+def to_epoch_ms(value: datetime) -> int:
+    """Epoch milliseconds for a timestamp; naive values are taken as UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def from_epoch_ms(value: int) -> str:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).isoformat()
+
+
 @app.on_event("startup")
 async def startup():
     init_db()
+    app.state.queue = asyncio.Queue()
+    app.state.conn = tune_connection(
+        sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    )
+    app.state.writer = asyncio.create_task(writer_loop(app.state.queue, app.state.conn))
+    app.state.readers = queue.Queue()
+    for _ in range(READER_POOL_SIZE):
+        app.state.readers.put(
+            tune_connection(sqlite3.connect(DB_PATH, check_same_thread=False))
+        )
     logger.info("Audit logger started")
 
 
-async def log_to_db(log: AuditLog):
-    """Fire-and-forget logging to SQLite."""
+@app.on_event("shutdown")
+async def shutdown():
+    # Let the writer flush everything queued before the connection goes away.
+    app.state.queue.put_nowait(None)
+    await app.state.writer
+    app.state.conn.close()
+    while not app.state.readers.empty():
+        app.state.readers.get_nowait().close()
+
+
+@contextmanager
+def acquire_reader():
+    """Borrow a pooled read connection, returning it when done."""
+    conn = app.state.readers.get()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute(
-            """INSERT INTO audit_logs 
-               (timestamp, username, endpoint, action, allowed) 
-               VALUES (?, ?, ?, ?, ?)""",
-            (log.timestamp, log.username, log.endpoint, log.action, log.allowed)
-        )
-        conn.commit()
-        conn.close()
-        logger.info(f"Audit logged: {log.username} - {log.action} - allowed={log.allowed}")
-    except Exception as e:
-        # Fire-and-forget: log error but don't fail
-        logger.error(f"Audit log failed: {e}")
+        yield conn
+    finally:
+        app.state.readers.put(conn)
+
+
+def write_batch(conn: sqlite3.Connection, rows: list[tuple]):
+    """Insert rows in one transaction (one journal sync instead of one per row)."""
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(_INSERT_SQL, rows)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+async def writer_loop(pending: "asyncio.Queue[Optional[tuple]]", conn: sqlite3.Connection):
+    """Drain queued audit rows into SQLite in batches until a None sentinel."""
+    while True:
+        row = await pending.get()
+        if row is None:
+            return
+        batch = [row]
+        stop = False
+        while len(batch) < BATCH_SIZE and not pending.empty():
+            row = pending.get_nowait()
+            if row is None:
+                stop = True
+                break
+            batch.append(row)
+        try:
+            # Off the event loop: a commit may wait on disk.
+            await asyncio.to_thread(write_batch, conn, batch)
+            logger.info("Audit logged %d entries", len(batch))
+        except Exception as e:
+            # Fire-and-forget: log error but don't fail
+            logger.error("Audit log failed: %s", e)
+        if stop:
+            return
 
 
 @app.post("/log")
-async def create_log(log: AuditLog, background_tasks: BackgroundTasks):
+async def create_log(log: AuditLog):
     """Receive audit log entry."""
-    background_tasks.add_task(log_to_db, log)
+    app.state.queue.put_nowait(
+        (to_epoch_ms(log.timestamp), log.username, log.endpoint, log.action, log.allowed)
+    )
     return {"status": "queued"}
 
 
 @app.get("/logs")
-async def get_logs():
-    """View all logs (for testing)."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.execute(
-        "SELECT * FROM audit_logs ORDER BY timestamp DESC LIMIT 100"
-    )
-    rows = cursor.fetchall()
-    conn.close()
+def get_logs():
+    """View all logs (for testing). Sync, so FastAPI runs it in its threadpool."""
+    with acquire_reader() as conn:
+        rows = conn.execute(
+            "SELECT * FROM audit_logs ORDER BY timestamp DESC LIMIT 100"
+        ).fetchall()
     
     logs = [
         {
             "id": row[0],
-            "timestamp": row[1],
+            "timestamp": from_epoch_ms(row[1]),
             "username": row[2],
             "endpoint": row[3],
             "action": row[4],
@@ -0,0 +1,35 @@
+"""indexes for channel history and membership lookups
+
+Revision ID: 20261017_0002
+Revises: 20260226_0001
+Create Date: 2026-10-17 00:00:00
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261017_0002"
+down_revision: Union[str, None] = "20260226_0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_messages_channel_ts", "messages", ["channel_id", "timestamp"], unique=False
+    )
+    op.create_index(
+        "ix_messages_sender_ts", "messages", ["sender_id", "timestamp"], unique=False
+    )
+    op.create_index(
+        op.f("ix_memberships_channel_id"), "memberships", ["channel_id"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_memberships_channel_id"), table_name="memberships")
+    op.drop_index("ix_messages_sender_ts", table_name="messages")
+    op.drop_index("ix_messages_channel_ts", table_name="messages")
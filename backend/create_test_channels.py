@@ -12,30 +12,32 @@ def create_test_channels():
         {"name": "#random", "type": "public"},
     ]
     
-    created_count = 0
-    existing_count = 0
+    names = [channel_data["name"] for channel_data in channels_to_create]
+    existing = dict(
+        db.query(Channel.name, Channel.id).filter(Channel.name.in_(names)).all()
+    )
+    new_channels = []
     
     for channel_data in channels_to_create:
         # Check if channel already exists
-        existing_channel = db.query(Channel).filter(Channel.name == channel_data["name"]).first()
-        if existing_channel:
-            print(f'Channel {channel_data["name"]} already exists (ID: {existing_channel.id})')
-            existing_count += 1
+        if channel_data["name"] in existing:
+            print(f'Channel {channel_data["name"]} already exists (ID: {existing[channel_data["name"]]})')
             continue
         
         # Create a new channel
-        new_channel = Channel(
+        new_channels.append(Channel(
             name=channel_data["name"],
             type=channel_data["type"]
-        )
-        
-        # Add and commit the new channel
-        db.add(new_channel)
-        db.commit()
-        db.refresh(new_channel)
-        
-        print(f'Channel {channel_data["name"]} created successfully. ID: {new_channel.id}')
-        created_count += 1
+        ))
+    
+    # Add all new channels and commit once
+    db.add_all(new_channels)
+    db.commit()
+    
+    for new_channel in new_channels:
+        print(f'Channel {new_channel.name} created successfully. ID: {new_channel.id}')
+    created_count = len(new_channels)
+    existing_count = len(channels_to_create) - created_count
     
     print(f'\nSummary: Created {created_count} channel(s), {existing_count} already existed.')
     db.close()
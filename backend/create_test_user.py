@@ -1,5 +1,7 @@
 import argparse
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterable, Sequence, Tuple
 
@@ -20,7 +22,7 @@ def load_users_from_file(file_path: Path) -> list[Tuple[str, str, str]]:
     }
     """
     try:
-        content = file_path.read_text(encoding="utf-8")
+        content = file_path.read_bytes()
     except OSError as exc:
         raise RuntimeError(f"Failed to read seed file '{file_path}': {exc}") from exc
 
@@ -66,25 +68,46 @@ def load_users_from_file(file_path: Path) -> list[Tuple[str, str, str]]:
 
 def create_users(users: Iterable[Tuple[str, str, str]]) -> None:
     """Create the given users if they do not already exist."""
+    users = list(users)
     Base.metadata.create_all(bind=engine)
     db = SessionLocal()
     try:
+        existing = dict(
+            db.query(User.username, User.id)
+            .filter(User.username.in_({username for username, _, _ in users}))
+            .all()
+        )
+        to_create: list[Tuple[str, str, str]] = []
+        pending: set[str] = set()
         for username, password, display_name in users:
-            existing_user = db.query(User).filter(User.username == username).first()
-            if existing_user:
-                print(f"User '{username}' already exists (id={existing_user.id})")
+            if username in existing:
+                print(f"User '{username}' already exists (id={existing[username]})")
                 continue
+            if username in pending:
+                print(f"User '{username}' listed more than once; skipping duplicate")
+                continue
+            to_create.append((username, password, display_name))
+            pending.add(username)
+
+        # bcrypt releases the GIL, so threads hash on all cores at once.
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            hashes = list(executor.map(get_password_hash, [password for _, password, _ in to_create]))
 
-            new_user = User(
+        new_users = [
+            User(
                 username=username,
                 display_name=display_name,
-                password_hash=get_password_hash(password),
+                password_hash=password_hash,
                 hash_type="bcrypt",
             )
-            db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
-            print(f"User '{username}' created successfully (id={new_user.id})")
+            for (username, _, display_name), password_hash in zip(to_create, hashes)
+        ]
+
+        # One transaction for the whole batch instead of a commit per user.
+        db.add_all(new_users)
+        db.commit()
+        for new_user in new_users:
+            print(f"User '{new_user.username}' created successfully (id={new_user.id})")
     finally:
         db.close()
 
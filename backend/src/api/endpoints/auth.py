@@ -260,8 +260,7 @@ async def get_current_user(
             raise credentials_exception
         
         # Remove "Bearer " prefix if present
-        if token.startswith("Bearer "):
-            token = token[7:]
+        token = token.removeprefix("Bearer ")
             
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username_value = payload.get("sub")
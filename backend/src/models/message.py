@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from datetime import datetime
 from src.core.database import Base
 
@@ -11,3 +11,9 @@ class Message(Base):
     channel_id = Column(Integer, ForeignKey("channels.id"))
     target_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     timestamp = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # Channel history and per-sender lookups, both ordered by time.
+        Index("ix_messages_channel_ts", "channel_id", "timestamp"),
+        Index("ix_messages_sender_ts", "sender_id", "timestamp"),
+    )